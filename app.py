@@ -1,18 +1,13 @@
-from flask import Flask, request, jsonify, send_file, render_template, send_from_directory
+from flask import Flask, request, jsonify, render_template, abort
+from werkzeug.utils import safe_join
 import os
-import cv2
-import numpy as np
-import sqlite3
-from pathlib import Path
-from io import BytesIO
-from photo_cascade import (
-    load_reference_image,
-    get_product_images,
-    preprocess_images,
-    create_photo_cascade,
-    get_average_aspect_ratio,
-    calculate_optimal_grid_size
-)
+import mimetypes
+from app.utils.http_utils import send_cached_jpeg, send_image
+from app.utils.image_utils import allowed_file
+from app.utils.render_utils import render_jpeg
+from result_cache import ResultCache
+from book_catalog import list_books
+from thumbnails import THUMBNAIL_FORMATS, THUMBNAIL_WIDTHS, get_derivative, image_urls, preferred_format, source_version
 import json
 from config import Config
 
@@ -23,16 +18,9 @@ def create_app(config_class=Config):
     # Ensure images directory exists
     os.makedirs(app.config['IMAGES_DIR'], exist_ok=True)
     
-    def allowed_file(filename):
-        return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
-    
-    def load_image_from_bytes(file_bytes):
-        """Load an image from bytes using OpenCV"""
-        nparr = np.frombuffer(file_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if img is None:
-            raise ValueError("Could not decode image")
-        return img
+    results = ResultCache(app.config['RESULT_CACHE_DIR'], app.config['RESULT_CACHE_MAX_BYTES'],
+                          memory_items=app.config['RESULT_CACHE_ITEMS'])
+    assignments = ResultCache(None, 0, memory_items=app.config['ASSIGNMENT_CACHE_ITEMS'])
     
     @app.route('/')
     def index():
@@ -51,39 +39,22 @@ def create_app(config_class=Config):
         # Check if we're in default state
         is_default_state = sort_by == 'date' and sort_order == 'desc'
         
-        valid_sorts = {
-            'name': 'title',
-            'price': 'price'
-        }
-        sort_column = valid_sorts.get(sort_by, 'title')
-        
-        # Connect to database
-        conn = sqlite3.connect(app.config['DATABASE_PATH'])
-        cursor = conn.cursor()
-        
-        # Get total count of books
-        cursor.execute('SELECT COUNT(*) FROM products WHERE local_image_path IS NOT NULL')
-        total_books = cursor.fetchone()[0]
-        
-        # Calculate total pages
-        total_pages = (total_books + per_page - 1) // per_page
-        
-        # Get paginated products with sorting
-        offset = (page - 1) * per_page
-        cursor.execute(f'''
-        SELECT p.id, p.title, p.price, p.vendor, p.local_image_path, p.url, p.labels
-        FROM products p
-        WHERE p.local_image_path IS NOT NULL
-        ORDER BY {sort_column} {sort_order.upper()}
-        LIMIT ? OFFSET ?
-        ''', (per_page, offset))
+        # Seek from the neighbouring page's cursor when following next/prev links
+        listing = list_books(app.config['DATABASE_PATH'], sort_by, sort_order, page, per_page,
+                             after=request.args.get('after'), before=request.args.get('before'))
         
         books = []
-        for row in cursor.fetchall():
+        for row in listing['rows']:
             product_id, title, price, vendor, main_image, url, labels_json = row
             
-            # Convert path to URL
-            main_image_url = f'/public/{os.path.basename(main_image)}' if main_image else None
+            # Convert path to URLs of the cover and its thumbnails, versioned so
+            # browsers can cache them until the file changes
+            main_image_url, thumbnails = None, {}
+            if main_image:
+                filename = os.path.basename(main_image.replace('\\', '/'))
+                path = os.path.join(app.config['IMAGES_DIR'], filename)
+                version = source_version(path) if os.path.isfile(path) else None
+                main_image_url, thumbnails = image_urls(filename, version)
             
             # Ensure URL is absolute
             if url and not url.startswith('http'):
@@ -98,22 +69,46 @@ def create_app(config_class=Config):
                 'price': price,
                 'vendor': vendor,
                 'main_image': main_image_url,
+                'thumbnails': thumbnails,
                 'url': url,
                 'labels': labels
             })
         
-        conn.close()
         return render_template('books.html', 
                              books=books, 
-                             current_page=page,
-                             total_pages=total_pages,
+                             current_page=listing['page'],
+                             total_pages=listing['total_pages'],
+                             next_cursor=listing['next_cursor'],
+                             prev_cursor=listing['prev_cursor'],
                              current_sort=sort_by,
                              current_order=sort_order,
                              is_default_state=is_default_state)
     
+    def source_path(filename):
+        path = safe_join(app.config['IMAGES_DIR'], filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        return path
+    
     @app.route('/public/<filename>')
     def serve_image(filename):
-        return send_from_directory(app.config['IMAGES_DIR'], filename)
+        path = source_path(filename)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        return send_image(path, mimetype, versioned=request.args.get('v') == source_version(path))
+    
+    @app.route('/thumbs/<int:width>/<filename>')
+    def serve_thumbnail(width, filename):
+        if width not in THUMBNAIL_WIDTHS:
+            abort(404)
+        path = source_path(filename)
+        fmt = preferred_format(request.accept_mimetypes)
+        thumbnail = get_derivative(path, width, fmt, app.config['THUMBNAIL_DIR'])
+        if thumbnail is None:
+            abort(404)
+        response = send_image(thumbnail, THUMBNAIL_FORMATS[fmt][1],
+                              versioned=request.args.get('v') == source_version(path))
+        response.vary.add('Accept')
+        return response
     
     @app.route('/api/create-cascade', methods=['POST'])
     def create_cascade():
@@ -136,58 +131,25 @@ def create_app(config_class=Config):
             horizontal_grid_size = int(request.form.get('horizontal_grid_size', 40))
             overlap = float(request.form.get('overlap', 0))
             original_filename = request.form.get('original_filename', 'photo')
+            preview = request.form.get('preview', '0').lower() in ('1', 'true', 'yes')
+            preview_width = app.config['PREVIEW_WIDTH'] if preview else None
             
             try:
-                # Load reference image from bytes
-                reference_img = load_image_from_bytes(file_bytes)
-                
-                # Upscale reference image to 1000px width
-                h, w = reference_img.shape[:2]
-                aspect_ratio = h / w
-                new_width = 1000
-                new_height = int(new_width * aspect_ratio)
-                reference_img = cv2.resize(reference_img, (new_width, new_height))
-                
-                # Get product images from database
-                image_paths = get_product_images(app.config['DATABASE_PATH'])
-                
-                # Calculate average aspect ratio and optimal grid size
-                avg_product_aspect_ratio = get_average_aspect_ratio(image_paths)
-                horizontal_grid_size, vertical_grid_size = calculate_optimal_grid_size(
-                    new_width, new_height, avg_product_aspect_ratio, horizontal_grid_size
-                )
-                
-                # Calculate cell size
-                cell_w = new_width // horizontal_grid_size
-                cell_h = new_height // vertical_grid_size
-                cell_size = (cell_w, cell_h)
-                
-                # Pre-process images
-                processed_images = preprocess_images(image_paths, cell_size)
-                
-                # Create photo cascade in memory
-                output_img = np.zeros_like(reference_img, dtype=np.float32)
-                create_photo_cascade(
-                    reference_img, 
-                    processed_images, 
-                    output_img,  # Pass the output array directly
+                # Render, or serve a repeated request from the result cache
+                output_bytes, key, cache_status, _ = render_jpeg(
+                    file_bytes,
                     horizontal_grid_size=horizontal_grid_size,
-                    vertical_grid_size=vertical_grid_size,
-                    overlap=overlap
-                )
-                
-                # Convert the output image to bytes
-                output_img_uint8 = output_img.astype(np.uint8)
-                _, buffer = cv2.imencode('.jpg', output_img_uint8)
-                output_bytes = BytesIO(buffer)
-                
-                # Return the generated image
-                return send_file(
-                    output_bytes,
-                    mimetype='image/jpeg',
-                    as_attachment=True,
-                    download_name=f'{original_filename}_cascade.jpg'
+                    overlap=overlap,
+                    db_path=app.config['DATABASE_PATH'],
+                    backend=app.config['RENDER_BACKEND'],
+                    workers=app.config['RENDER_WORKERS'],
+                    preview_width=preview_width,
+                    results=results,
+                    assignments=assignments,
+                    known_etags=request.if_none_match
                 )
+                return send_cached_jpeg(output_bytes, key, cache_status,
+                                        download_name=f'{original_filename}_cascade.jpg')
                 
             except Exception as e:
                 return jsonify({'error': str(e)}), 500
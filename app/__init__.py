@@ -1,5 +1,6 @@
 
-from flask import Flask
+import time
+from flask import Flask, g, request
 from flask_sqlalchemy import SQLAlchemy
 from config import Config
 
@@ -19,7 +20,53 @@ def create_app(config_class=Config):
     from app.books import bp as books_bp
     app.register_blueprint(books_bp, url_prefix='/books')
 
+    from app.images import bp as images_bp
+    app.register_blueprint(images_bp)
+
     from app.cascade import bp as cascade_bp
     app.register_blueprint(cascade_bp, url_prefix='/api')
 
+    # Request and render metrics, served as Prometheus text on /metrics
+    from app.utils.metrics import MetricsRegistry
+    metrics = app.extensions['cascade_metrics'] = MetricsRegistry()
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        endpoint = request.endpoint or 'unmatched'
+        metrics.requests.inc(endpoint=endpoint, status=response.status_code)
+        if response.status_code >= 500:
+            metrics.errors.inc(endpoint=endpoint)
+        if 'request_started' in g:
+            metrics.request_seconds.observe(time.perf_counter() - g.request_started, endpoint=endpoint)
+        return response
+
+    from app.metrics import bp as metrics_bp
+    app.register_blueprint(metrics_bp)
+
+    from result_cache import ResultCache
+    app.extensions['cascade_results'] = ResultCache(
+        app.config['RESULT_CACHE_DIR'],
+        app.config['RESULT_CACHE_MAX_BYTES'],
+        memory_items=app.config['RESULT_CACHE_ITEMS']
+    )
+    app.extensions['cascade_assignments'] = ResultCache(
+        None, 0, memory_items=app.config['ASSIGNMENT_CACHE_ITEMS']
+    )
+
+    from app.jobs import bp as jobs_bp
+    from app.jobs.manager import JobManager
+    app.extensions['cascade_jobs'] = JobManager(
+        workers=app.config['JOB_WORKERS'],
+        queue_depth=app.config['JOB_QUEUE_DEPTH'],
+        ttl=app.config['JOB_TTL'],
+        results=app.extensions['cascade_results'],
+        assignments=app.extensions['cascade_assignments'],
+        metrics=app.extensions['cascade_metrics']
+    )
+    app.register_blueprint(jobs_bp, url_prefix='/api')
+
     return app 
\ No newline at end of file
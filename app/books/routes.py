@@ -1,7 +1,8 @@
-import sqlite3
 import json
 from flask import render_template, request, current_app
 from app.books import bp
+from book_catalog import list_books
+from thumbnails import image_urls, source_version
 import os
 
 @bp.route('/')
@@ -17,39 +18,23 @@ def books():
     # Check if we're in default state
     is_default_state = sort_by == 'name' and sort_order == 'asc'
     
-    valid_sorts = {
-        'name': 'title',
-        'price': 'CAST(price AS REAL)'  # Cast price to REAL for proper numeric sorting
-    }
-    sort_column = valid_sorts.get(sort_by, 'title')
-    
-    # Connect to database
-    conn = sqlite3.connect(current_app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', ''))
-    cursor = conn.cursor()
-    
-    # Get total count of books
-    cursor.execute('SELECT COUNT(*) FROM products WHERE local_image_path IS NOT NULL')
-    total_books = cursor.fetchone()[0]
-    
-    # Calculate total pages
-    total_pages = (total_books + per_page - 1) // per_page
-    
-    # Get paginated products with sorting
-    offset = (page - 1) * per_page
-    cursor.execute(f'''
-    SELECT p.id, p.title, p.price, p.vendor, p.local_image_path, p.url, p.labels
-    FROM products p
-    WHERE p.local_image_path IS NOT NULL
-    ORDER BY {sort_column} {sort_order.upper()}
-    LIMIT ? OFFSET ?
-    ''', (per_page, offset))
+    # Seek from the neighbouring page's cursor when following next/prev links
+    listing = list_books(current_app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', ''),
+                         sort_by, sort_order, page, per_page,
+                         after=request.args.get('after'), before=request.args.get('before'))
     
     books = []
-    for row in cursor.fetchall():
+    for row in listing['rows']:
         product_id, title, price, vendor, main_image, url, labels_json = row
         
-        # Convert path to URL
-        main_image_url = f'/public/{os.path.basename(main_image)}' if main_image else None
+        # Convert path to URLs of the cover and its thumbnails, versioned so
+        # browsers can cache them until the file changes
+        main_image_url, thumbnails = None, {}
+        if main_image:
+            filename = os.path.basename(main_image.replace('\\', '/'))
+            path = os.path.join(current_app.config['IMAGES_DIR'], filename)
+            version = source_version(path) if os.path.isfile(path) else None
+            main_image_url, thumbnails = image_urls(filename, version)
         
         # Ensure URL is absolute
         if url and not url.startswith('http'):
@@ -64,15 +49,17 @@ def books():
             'price': int(price) if price is not None else 0,  # Store as integer cents
             'vendor': vendor,
             'main_image': main_image_url,
+            'thumbnails': thumbnails,
             'url': url,
             'labels': labels
         })
     
-    conn.close()
     return render_template('books.html', 
                          books=books, 
-                         current_page=page,
-                         total_pages=total_pages,
+                         current_page=listing['page'],
+                         total_pages=listing['total_pages'],
+                         next_cursor=listing['next_cursor'],
+                         prev_cursor=listing['prev_cursor'],
                          current_sort=sort_by,
                          current_order=sort_order,
                          is_default_state=is_default_state) 
\ No newline at end of file
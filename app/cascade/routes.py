@@ -1,15 +1,9 @@
-from flask import request, jsonify, send_file, current_app
-from io import BytesIO
-import cv2
-import numpy as np
-from app.utils.image_utils import allowed_file, load_image_from_bytes
-from photo_cascade import (
-    get_product_images,
-    preprocess_images,
-    create_photo_cascade,
-    get_average_aspect_ratio,
-    calculate_optimal_grid_size
-)
+from flask import request, jsonify, current_app
+from app.cascade import bp
+from app.utils.image_utils import allowed_file
+from app.utils.http_utils import send_cached_jpeg
+from app.utils.render_utils import render_jpeg
+from app.utils.metrics import StageTimer
 
 @bp.route('/create-cascade', methods=['POST'])
 def create_cascade():
@@ -31,58 +25,31 @@ def create_cascade():
         # Get parameters from request
         horizontal_grid_size = int(request.form.get('horizontal_grid_size', 40))
         overlap = float(request.form.get('overlap', 0))
+        preview = request.form.get('preview', '0').lower() in ('1', 'true', 'yes')
         
         try:
-            # Load reference image from bytes
-            reference_img = load_image_from_bytes(file_bytes)
-            
-            # Upscale reference image to 1000px width
-            h, w = reference_img.shape[:2]
-            aspect_ratio = h / w
-            new_width = 1000
-            new_height = int(new_width * aspect_ratio)
-            reference_img = cv2.resize(reference_img, (new_width, new_height))
-            
-            # Get product images from database
-            image_paths = get_product_images(current_app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', ''))
-            
-            # Calculate average aspect ratio and optimal grid size
-            avg_product_aspect_ratio = get_average_aspect_ratio(image_paths)
-            horizontal_grid_size, vertical_grid_size = calculate_optimal_grid_size(
-                new_width, new_height, avg_product_aspect_ratio, horizontal_grid_size
-            )
-            
-            # Calculate cell size
-            cell_w = new_width // horizontal_grid_size
-            cell_h = new_height // vertical_grid_size
-            cell_size = (cell_w, cell_h)
-            
-            # Pre-process images
-            processed_images = preprocess_images(image_paths, cell_size)
-            
-            # Create photo cascade in memory
-            output_img = np.zeros_like(reference_img, dtype=np.float32)
-            create_photo_cascade(
-                reference_img, 
-                processed_images, 
-                output_img,
+            # Render, or serve a repeated request from the result cache
+            timer = StageTimer()
+            output_bytes, key, cache_status, stats = render_jpeg(
+                file_bytes,
                 horizontal_grid_size=horizontal_grid_size,
-                vertical_grid_size=vertical_grid_size,
-                overlap=overlap
+                overlap=overlap,
+                db_path=current_app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', ''),
+                backend=current_app.config['RENDER_BACKEND'],
+                workers=current_app.config['RENDER_WORKERS'],
+                preview_width=current_app.config['PREVIEW_WIDTH'] if preview else None,
+                results=current_app.extensions['cascade_results'],
+                assignments=current_app.extensions['cascade_assignments'],
+                progress=timer,
+                known_etags=request.if_none_match
             )
-            
-            # Convert the output image to bytes
-            output_img_uint8 = output_img.astype(np.uint8)
-            _, buffer = cv2.imencode('.jpg', output_img_uint8)
-            output_bytes = BytesIO(buffer)
+            timer.finish()
+            current_app.extensions['cascade_metrics'].observe_render(timer, cache_status, stats)
             
             # Return the generated image
-            return send_file(
-                output_bytes,
-                mimetype='image/jpeg',
-                as_attachment=True,
-                download_name='photo_cascade.jpg'
-            )
+            response = send_cached_jpeg(output_bytes, key, cache_status)
+            response.headers['Server-Timing'] = timer.server_timing()
+            return response
             
         except Exception as e:
             return jsonify({'error': str(e)}), 500
@@ -0,0 +1,5 @@
+from flask import Blueprint
+
+bp = Blueprint('images', __name__)
+
+from app.images import routes
@@ -0,0 +1,34 @@
+import mimetypes
+import os
+from flask import abort, current_app, request
+from werkzeug.utils import safe_join
+from app.images import bp
+from app.utils.http_utils import send_image
+from thumbnails import THUMBNAIL_FORMATS, THUMBNAIL_WIDTHS, get_derivative, preferred_format, source_version
+
+def source_path(filename):
+    """Path of an image under IMAGES_DIR, or 404"""
+    path = safe_join(current_app.config['IMAGES_DIR'], filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    return path
+
+@bp.route('/public/<filename>')
+def serve_image(filename):
+    path = source_path(filename)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    return send_image(path, mimetype, versioned=request.args.get('v') == source_version(path))
+
+@bp.route('/thumbs/<int:width>/<filename>')
+def serve_thumbnail(width, filename):
+    if width not in THUMBNAIL_WIDTHS:
+        abort(404)
+    path = source_path(filename)
+    fmt = preferred_format(request.accept_mimetypes)
+    thumbnail = get_derivative(path, width, fmt, current_app.config['THUMBNAIL_DIR'])
+    if thumbnail is None:
+        abort(404)
+    response = send_image(thumbnail, THUMBNAIL_FORMATS[fmt][1],
+                          versioned=request.args.get('v') == source_version(path))
+    response.vary.add('Accept')
+    return response
@@ -0,0 +1,114 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from app.utils.render_utils import render_jpeg
+from app.utils.metrics import StageTimer
+from photo_cascade import RENDER_STAGES
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at its depth limit"""
+
+class Job:
+    """State of one cascade render, updated from the worker thread"""
+
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status = 'queued'  # queued -> running -> done | failed
+        self.stage = None
+        self.progress = 0.0
+        self.error = None
+        self.result = None
+        self.etag = None
+        self.cache_status = None
+        self.timings = {}
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def report(self, stage, fraction):
+        """Progress callback for render_cascade; stages count equally"""
+        index = RENDER_STAGES.index(stage)
+        self.stage = stage
+        self.progress = (index + min(max(fraction, 0.0), 1.0)) / len(RENDER_STAGES)
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': round(self.progress, 4),
+            'error': self.error,
+            'timings': {stage: round(seconds, 4) for stage, seconds in self.timings.items()}
+        }
+
+class JobManager:
+    """Runs cascade renders on a bounded local thread pool.
+
+    At most queue_depth jobs may be queued or running at once; further
+    submissions raise QueueFullError. Finished jobs are kept in memory for
+    ttl seconds so their results can be fetched. results and assignments
+    are the caches passed on to render_jpeg; stage timings are recorded in
+    metrics when given.
+    """
+
+    def __init__(self, workers=1, queue_depth=8, ttl=600, results=None, assignments=None, metrics=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cascade-job')
+        self.queue_depth = queue_depth
+        self.ttl = ttl
+        self.results = results
+        self.assignments = assignments
+        self.metrics = metrics
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def prune(self):
+        """Forget finished jobs older than ttl"""
+        cutoff = time.time() - self.ttl
+        with self.lock:
+            expired = [job_id for job_id, job in self.jobs.items()
+                       if job.finished_at is not None and job.finished_at < cutoff]
+            for job_id in expired:
+                del self.jobs[job_id]
+
+    def pending(self):
+        with self.lock:
+            return sum(1 for job in self.jobs.values() if job.finished_at is None)
+
+    def submit(self, file_bytes, **render_options):
+        """Queue a render of the uploaded image bytes and return its Job"""
+        self.prune()
+        job = Job(uuid.uuid4().hex)
+        with self.lock:
+            pending = sum(1 for queued in self.jobs.values() if queued.finished_at is None)
+            if pending >= self.queue_depth:
+                raise QueueFullError(f"{pending} jobs already pending")
+            self.jobs[job.id] = job
+        self.executor.submit(self.run, job, file_bytes, render_options)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def run(self, job, file_bytes, render_options):
+        job.status = 'running'
+        timer = StageTimer(job.report)
+        try:
+            job.result, job.etag, job.cache_status, stats = render_jpeg(
+                file_bytes, results=self.results, assignments=self.assignments,
+                progress=timer, **render_options
+            )
+            timer.finish()
+            if self.metrics is not None:
+                self.metrics.observe_render(timer, job.cache_status, stats)
+            job.status = 'done'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            timer.finish()
+            job.timings = timer.durations
+            job.finished_at = time.time()
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
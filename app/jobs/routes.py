@@ -0,0 +1,70 @@
+from flask import request, jsonify, current_app, url_for
+from app.jobs import bp
+from app.jobs.manager import QueueFullError
+from app.utils.image_utils import allowed_file
+from app.utils.http_utils import send_cached_jpeg
+
+def get_manager():
+    return current_app.extensions['cascade_jobs']
+
+@bp.route('/jobs', methods=['POST'])
+def submit_job():
+    # Check if reference image was uploaded
+    if 'reference_image' not in request.files:
+        return jsonify({'error': 'No reference image provided'}), 400
+    
+    file = request.files['reference_image']
+    if file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+    
+    if not allowed_file(file.filename):
+        return jsonify({'error': 'Invalid file type'}), 400
+    
+    try:
+        horizontal_grid_size = int(request.form.get('horizontal_grid_size', 40))
+        overlap = float(request.form.get('overlap', 0))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Settings are read here because the job runs outside the app context
+    try:
+        job = get_manager().submit(
+            file.read(),
+            db_path=current_app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', ''),
+            horizontal_grid_size=horizontal_grid_size,
+            overlap=overlap,
+            backend=current_app.config['RENDER_BACKEND'],
+            workers=current_app.config['RENDER_WORKERS']
+        )
+    except QueueFullError as e:
+        response = jsonify({'error': f'Job queue is full: {e}'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    
+    body = job.to_dict()
+    body['status_url'] = url_for('jobs.job_status', job_id=job.id)
+    body['result_url'] = url_for('jobs.job_result', job_id=job.id)
+    response = jsonify(body)
+    response.headers['Location'] = body['status_url']
+    return response, 202
+
+@bp.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = get_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
+
+@bp.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = get_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job.status == 'failed':
+        return jsonify(job.to_dict()), 500
+    if job.status != 'done':
+        response = jsonify(job.to_dict())
+        response.headers['Retry-After'] = '1'
+        return response, 202
+    
+    return send_cached_jpeg(job.result, job.etag, job.cache_status)
@@ -0,0 +1,7 @@
+from flask import current_app
+from app.metrics import bp
+
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    body = current_app.extensions['cascade_metrics'].render()
+    return body, 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
@@ -0,0 +1,39 @@
+import os
+from io import BytesIO
+from flask import request, send_file, current_app
+from thumbnails import file_etag
+
+def send_cached_jpeg(data, etag, cache_status=None, download_name='photo_cascade.jpg'):
+    """Send an encoded cascade with a strong ETag, or 304 if the client has it"""
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        response = send_file(
+            BytesIO(data),
+            mimetype='image/jpeg',
+            as_attachment=True,
+            download_name=download_name
+        )
+    response.set_etag(etag)
+    if cache_status is not None:
+        response.headers['X-Cache'] = cache_status
+    return response
+
+# Versioned image URLs name one exact file, so they can be kept for a year
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+def send_image(path, mimetype, versioned=False):
+    """Send an image file with a content-hash ETag, answering 304 when it matches
+
+    Versioned requests are marked immutable; the others are revalidated
+    on every use.
+    """
+    # Relative paths are taken from the working directory, not the app package
+    path = os.path.abspath(path)
+    response = send_file(path, mimetype=mimetype, etag=file_etag(path), conditional=True,
+                         max_age=IMMUTABLE_MAX_AGE if versioned else 0)
+    if versioned:
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
@@ -0,0 +1,132 @@
+import bisect
+import threading
+import time
+
+# Histogram upper bounds in seconds, from a cached hit to a cold render
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, _format_labels(self.labels, key), value) for key, value in sorted(self.values.items())]
+
+class Histogram:
+    """Cumulative bucket histogram with optional labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}  # labels -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self.lock:
+            state = self.values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, state in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, state):
+                    cumulative += count
+                    samples.append((f'{self.name}_bucket', _format_labels(self.labels, key, [('le', repr(bound))]), cumulative))
+                samples.append((f'{self.name}_bucket', _format_labels(self.labels, key, [('le', '+Inf')]), state[-1]))
+                samples.append((f'{self.name}_sum', _format_labels(self.labels, key), state[-2]))
+                samples.append((f'{self.name}_count', _format_labels(self.labels, key), state[-1]))
+        return samples
+
+class MetricsRegistry:
+    """The service metrics, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.requests = Counter('cascade_requests_total', 'HTTP requests handled', ('endpoint', 'status'))
+        self.errors = Counter('cascade_errors_total', 'Requests that failed with a server error', ('endpoint',))
+        self.request_seconds = Histogram('cascade_request_seconds', 'Request latency', ('endpoint',))
+        self.stage_seconds = Histogram('cascade_stage_seconds', 'Time spent in each render stage', ('stage',))
+        self.result_cache = Counter('cascade_result_cache_total', 'Result cache lookups', ('result',))
+        self.tiles_scanned = Counter('cascade_tiles_scanned_total', 'Library tiles matched against, summed over renders')
+        self.metrics = [self.requests, self.errors, self.request_seconds, self.stage_seconds,
+                        self.result_cache, self.tiles_scanned]
+
+    def observe_render(self, timer, cache_status, stats):
+        """Record one render_jpeg call timed by timer"""
+        for stage, seconds in timer.durations.items():
+            self.stage_seconds.observe(seconds, stage=stage)
+        self.result_cache.inc(result=cache_status.lower())
+        if stats is not None:
+            self.tiles_scanned.inc(stats.get('tiles', 0))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {value}')
+        return '\n'.join(lines) + '\n'
+
+class StageTimer:
+    """Progress callback that measures how long each stage lasts.
+
+    Pass it as progress to render_jpeg; a stage ends when the next one is
+    reported. forward, if given, receives every call as well.
+    """
+
+    def __init__(self, forward=None):
+        self.forward = forward
+        self.durations = {}
+        self.stage = None
+        self.started = None
+
+    def __call__(self, stage, fraction):
+        if stage != self.stage:
+            self.finish()
+            self.stage = stage
+            self.started = time.perf_counter()
+        if self.forward is not None:
+            self.forward(stage, fraction)
+
+    def finish(self):
+        """End the current stage"""
+        if self.stage is not None:
+            elapsed = time.perf_counter() - self.started
+            self.durations[self.stage] = self.durations.get(self.stage, 0.0) + elapsed
+            self.stage = None
+
+    def server_timing(self):
+        """Value for the Server-Timing response header"""
+        return ', '.join(f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in self.durations.items())
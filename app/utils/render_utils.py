@@ -0,0 +1,63 @@
+import cv2
+from app.utils.image_utils import load_image_from_bytes
+from photo_cascade import prepare_reference, render_cascade, load_library
+from result_cache import cascade_cache_key
+
+def render_jpeg(file_bytes, horizontal_grid_size=40, overlap=0, db_path=None, backend='thread', workers=None,
+                preview_width=None, results=None, assignments=None, progress=None, known_etags=()):
+    """Render uploaded reference bytes to JPEG, going through the caches.
+
+    results caches the encoded output, assignments the cell-to-tile choice
+    so that a preview and the full render of the same image share it.
+    known_etags are the ETags the client already holds (If-None-Match);
+    when the cache key is one of them nothing is rendered or read and the
+    bytes are None. Returns (jpeg bytes, cache key, 'HIT' or 'MISS',
+    render stats); the stats are None for a cache hit.
+    """
+    report = progress or (lambda stage, fraction: None)
+    report('lookup', 0.0)
+    # The library is loaded once and shared by the cache key and the render
+    library = load_library(db_path)
+    version = library['version']
+    mode = 'preview' if preview_width else 'full'
+    key = cascade_cache_key(file_bytes, horizontal_grid_size, overlap, version, mode)
+    if key in known_etags:
+        report('encode', 1.0)
+        return None, key, 'HIT', None
+    if results is not None:
+        cached = results.get(key)
+        if cached is not None:
+            report('encode', 1.0)
+            return cached, key, 'HIT', None
+    
+    # Load reference image from bytes and upscale it to 1000px width
+    report('decode', 0.0)
+    reference_img = prepare_reference(load_image_from_bytes(file_bytes))
+    
+    assignment_key = cascade_cache_key(file_bytes, horizontal_grid_size, 0, version, 'assignment')
+    assignment = assignments.get(assignment_key) if assignments is not None else None
+    
+    # Render the mosaic from the tile library
+    output_img, stats = render_cascade(
+        reference_img,
+        db_path,
+        horizontal_grid_size=horizontal_grid_size,
+        overlap=overlap,
+        backend=backend,
+        workers=workers,
+        progress=progress,
+        preview_width=preview_width,
+        assignment=assignment,
+        library=library
+    )
+    if assignments is not None and assignment is None and stats['assignment'] is not None:
+        assignments.put(assignment_key, stats['assignment'])
+    
+    # Convert the output image to bytes
+    report('encode', 0.0)
+    _, buffer = cv2.imencode('.jpg', output_img)
+    output_bytes = buffer.tobytes()
+    if results is not None:
+        results.put(key, output_bytes)
+    report('encode', 1.0)
+    return output_bytes, key, 'MISS', stats
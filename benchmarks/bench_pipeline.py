@@ -0,0 +1,219 @@
+"""Time each stage of the cascade pipeline on synthetic tile libraries.
+
+Every library is written as small JPEGs into a temporary directory and
+registered in a temporary SQLite database with the mph_images.db schema.
+Run from the repository root:
+
+    python benchmarks/bench_pipeline.py --tiles 1000 10000 100000 --json results.json
+    python benchmarks/bench_pipeline.py --tiles 1000 --json new.json --compare results.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from download_images import setup_database
+from photo_cascade import (
+    get_product_images,
+    get_average_aspect_ratio,
+    preprocess_images,
+    calculate_optimal_grid_size,
+    compute_integral_images,
+    get_tile_index,
+    match_cells,
+    create_photo_cascade,
+    prepare_reference
+)
+from tile_cache import load_tile_atlas
+from tile_dedupe import dedupe_features
+from tile_features import load_tile_features
+
+# Source image shapes (width, height) drawn at random for the library
+TILE_SHAPES = ((48, 64), (64, 48), (48, 72), (56, 56))
+
+def make_tile(kind, rng):
+    """One synthetic product image: a solid color or a noisy texture around one"""
+    w, h = TILE_SHAPES[rng.integers(len(TILE_SHAPES))]
+    color = rng.integers(0, 256, 3)
+    if kind == 'mixed':
+        kind = 'solid' if rng.random() < 0.5 else 'noisy'
+    if kind == 'solid':
+        return np.broadcast_to(color, (h, w, 3)).astype(np.uint8)
+    noise = rng.normal(0, 40, (h, w, 3))
+    return np.clip(color + noise, 0, 255).astype(np.uint8)
+
+def build_library(n_tiles, kind, work_dir, rng):
+    """Write n_tiles images and a database that lists them like the real catalog"""
+    images_dir = os.path.join(work_dir, 'images')
+    os.makedirs(images_dir, exist_ok=True)
+    db_path = os.path.join(work_dir, 'bench.db')
+    conn, cursor = setup_database(db_path)
+
+    products = []
+    for index in tqdm(range(n_tiles), desc=f'{n_tiles} {kind} tiles'):
+        path = os.path.join(images_dir, f'{index}.jpg')
+        cv2.imwrite(path, make_tile(kind, rng))
+        products.append((index, f'Book {index}', f'book-{index}', 1000 + index, 'Bench', path))
+
+    cursor.executemany('''
+    INSERT INTO products (id, title, handle, price, vendor, local_image_path)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ''', products)
+    conn.commit()
+    conn.close()
+    return db_path
+
+def time_call(fn, repeat=1):
+    """Best wall-clock time of repeat calls, and the last result"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def bench_library(n_tiles, kind, reference_img, grids, overlaps, repeat, rng, verbose):
+    """Time every stage for one library; returns a list of result rows"""
+    results = []
+
+    def record(stage, seconds, **params):
+        results.append({'tiles': n_tiles, 'kind': kind, 'stage': stage, 'seconds': seconds, **params})
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        db_path = build_library(n_tiles, kind, work_dir, rng)
+        cache_dir = os.path.join(work_dir, 'cache')
+        quiet = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+
+        with quiet:
+            seconds, image_paths = time_call(lambda: get_product_images(db_path, dedupe=False), repeat)
+            record('get_product_images', seconds)
+
+            # The first call fills the tile_features table, later ones only stat
+            seconds, aspect_ratio = time_call(lambda: get_average_aspect_ratio(image_paths, db_path))
+            record('get_average_aspect_ratio_cold', seconds)
+
+            # Clustering alone; dedupe_image_paths would serve repeats from its cache
+            features = load_tile_features(image_paths, db_path)
+            seconds, (kept, _) = time_call(lambda: dedupe_features(features, Config.DEDUPE_MAX_DISTANCE), repeat)
+            record('dedupe', seconds, kept=len(kept))
+            image_paths = [feature['path'] for feature in kept]
+
+            seconds, aspect_ratio = time_call(lambda: get_average_aspect_ratio(image_paths, db_path), repeat)
+            record('get_average_aspect_ratio', seconds)
+
+            ref_h, ref_w = reference_img.shape[:2]
+            integral_images = compute_integral_images(reference_img)
+            for grid in grids:
+                h, v = calculate_optimal_grid_size(ref_w, ref_h, aspect_ratio, grid)
+                cell_size = (ref_w // h, ref_h // v)
+                params = {'grid': f'{h}x{v}'}
+
+                seconds, _ = time_call(lambda: preprocess_images(image_paths, cell_size))
+                record('preprocess_images', seconds, **params)
+
+                seconds, atlas = time_call(lambda: load_tile_atlas(image_paths, cell_size, db_path, cache_dir))
+                record('load_tile_atlas_cold', seconds, **params)
+                seconds, atlas = time_call(lambda: load_tile_atlas(image_paths, cell_size, db_path, cache_dir), repeat)
+                record('load_tile_atlas', seconds, **params)
+
+                # Built once per atlas; the match timings below reuse it
+                seconds, _ = time_call(lambda: get_tile_index(atlas))
+                record('tile_index', seconds, **params)
+
+                seconds, assignment = time_call(
+                    lambda: match_cells(reference_img, atlas, h, v, integral_images=integral_images), repeat)
+                record('match', seconds, **params)
+
+                for overlap in overlaps:
+                    def blend():
+                        output_img = np.zeros_like(reference_img, dtype=np.float32)
+                        create_photo_cascade(reference_img, atlas, output_img, h, v, overlap,
+                                             assignment=assignment)
+                        return output_img.astype(np.uint8)
+                    seconds, output_img = time_call(blend, repeat)
+                    record('blend', seconds, overlap=overlap, **params)
+
+                    seconds, _ = time_call(lambda: cv2.imencode('.jpg', output_img), repeat)
+                    record('encode', seconds, overlap=overlap, **params)
+    return results
+
+def row_key(row):
+    return (row['tiles'], row['kind'], row['stage'], row.get('grid'), row.get('overlap'))
+
+def describe(row):
+    params = ''.join(f' {key}={row[key]}' for key in ('grid', 'overlap') if key in row)
+    return f"{row['stage']}{params}"
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tiles', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--kind', choices=('solid', 'noisy', 'mixed'), default='mixed')
+    parser.add_argument('--grids', type=int, nargs='+', default=[20, 40, 80], help='horizontal cells')
+    parser.add_argument('--overlaps', type=float, nargs='+', default=[0.0, 0.2])
+    parser.add_argument('--reference', default='static/example.png')
+    parser.add_argument('--width', type=int, default=1000, help='reference width after resizing')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', help='results file of an earlier run to compare against')
+    parser.add_argument('--verbose', action='store_true', help='keep the pipeline output')
+    args = parser.parse_args()
+
+    reference_img = cv2.imread(args.reference)
+    if reference_img is None:
+        parser.error(f"Could not read reference image {args.reference}")
+    reference_img = prepare_reference(reference_img, args.width)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {row_key(row): row['seconds'] for row in json.load(f)['results']}
+
+    rng = np.random.default_rng(args.seed)
+    results = []
+    print(f"{'tiles':>8} {'stage':<40} {'seconds':>10} {'vs base':>8}")
+    for n_tiles in args.tiles:
+        rows = bench_library(n_tiles, args.kind, reference_img, args.grids, args.overlaps,
+                             args.repeat, rng, args.verbose)
+        for row in rows:
+            base = baseline.get(row_key(row))
+            change = f"{row['seconds'] / base:>7.2f}x" if base else f"{'':>8}"
+            print(f"{row['tiles']:>8} {describe(row):<40} {row['seconds']:>10.4f} {change}")
+        results.extend(rows)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'opencv': cv2.__version__,
+                'cpus': os.cpu_count(),
+                'reference': args.reference,
+                'width': args.width,
+                'seed': args.seed,
+                'results': results
+            }, f, indent=2)
+
+if __name__ == '__main__':
+    main()
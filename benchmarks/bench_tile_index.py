@@ -0,0 +1,96 @@
+"""Compare tile lookup strategies against the original find_best_match.
+
+Run from the repository root:
+
+    python benchmarks/bench_tile_index.py --tiles 200 5000 50000 --cells 2400
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tile_matcher import build_tile_index, cKDTree
+
+def find_best_match(processed_images, target_color):
+    """Linear scan over every tile, the matcher photo_cascade used before TileIndex"""
+    best_match = None
+    best_diff = float('inf')
+
+    for img_data in processed_images:
+        diff = np.sum(np.abs(target_color - img_data['avg_color']))
+        if diff < best_diff:
+            best_diff = diff
+            best_match = img_data
+
+    return best_match
+
+def time_call(fn, repeat):
+    """Best wall-clock time of repeat calls, and the last result"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def bench_library(n_tiles, n_cells, k, repeat, rng, baseline_cells):
+    """Benchmark every index type on one synthetic library"""
+    tile_colors = rng.random((n_tiles, 3)) * 255
+    cell_colors = rng.random((n_cells, 3)) * 255
+    results = []
+
+    # The per-cell Python scan is too slow to run on every cell of a big
+    # library, so time a sample and scale up to the full grid.
+    sample = cell_colors[:min(baseline_cells, n_cells)]
+    processed_images = [{'avg_color': color} for color in tile_colors]
+    seconds, _ = time_call(lambda: [find_best_match(processed_images, c) for c in sample], 1)
+    results.append({'tiles': n_tiles, 'cells': n_cells, 'method': 'find_best_match',
+                    'build_s': 0.0, 'query_s': seconds * n_cells / len(sample), 'recall': 1.0})
+
+    exact_idx = build_tile_index(tile_colors, 'brute').query(cell_colors, k)[1]
+    configs = [('brute', {}), ('ivf', {}), ('ivf', {'n_probe': 16})]
+    if cKDTree is not None:
+        configs += [('kdtree', {}), ('kdtree', {'eps': 0.5})]
+
+    for kind, options in configs:
+        build_s, index = time_call(lambda: build_tile_index(tile_colors, kind, **options), 1)
+        query_s, (_, idx) = time_call(lambda: index.query(cell_colors, k), repeat)
+        recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(idx, exact_idx)])
+        label = kind + ''.join(f' {key}={value}' for key, value in options.items())
+        results.append({'tiles': n_tiles, 'cells': n_cells, 'method': label,
+                        'build_s': build_s, 'query_s': query_s, 'recall': float(recall)})
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tiles', type=int, nargs='+', default=[200, 5000, 50000])
+    parser.add_argument('--cells', type=int, default=2400, help='grid cells per query batch (40x60 = 2400)')
+    parser.add_argument('-k', type=int, default=1, help='neighbours per cell')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline-cells', type=int, default=200,
+                        help='cells actually scanned by find_best_match before extrapolating')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    results = []
+    print(f"{'tiles':>8} {'method':<20} {'build (s)':>10} {'query (s)':>10} {'speedup':>8} {'recall':>7}")
+    for n_tiles in args.tiles:
+        rows = bench_library(n_tiles, args.cells, args.k, args.repeat, rng, args.baseline_cells)
+        baseline = rows[0]['query_s']
+        for row in rows:
+            print(f"{row['tiles']:>8} {row['method']:<20} {row['build_s']:>10.4f} {row['query_s']:>10.4f} "
+                  f"{baseline / row['query_s']:>7.0f}x {row['recall']:>7.3f}")
+        results.extend(rows)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+import argparse
+import base64
+import json
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from config import Config
+
+# Sort keys of the /books listing. Each is paired with the product id so
+# the order is total and a page boundary can be expressed as a cursor.
+SORT_COLUMNS = {
+    'name': 'title_key',
+    'price': 'price_cents',
+}
+
+# Generated columns behind the sort keys. Older databases hold some prices
+# as text, and a NULL key would never compare in a cursor's (key, id)
+# bound, so SQLite maintains a non-NULL copy itself and the ingest code
+# needs no change. A missing price sorts as 0, as the listing shows it.
+SORT_KEY_COLUMNS = {
+    'title_key': "TEXT GENERATED ALWAYS AS (COALESCE(title, '')) VIRTUAL",
+    'price_cents': 'INTEGER GENERATED ALWAYS AS (COALESCE(CAST(price AS INTEGER), 0)) VIRTUAL',
+}
+
+# Sorting expression used on databases that setup_catalog has not migrated
+UNMIGRATED_SORT_COLUMNS = {
+    'name': "COALESCE(title, '')",
+    'price': 'COALESCE(CAST(price AS INTEGER), 0)',
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+# Listed book count per database: {db_path: count}, see count_listed_books
+_counts = {}
+_counts_lock = threading.Lock()
+
+def setup_catalog(conn):
+    """Add the sort key columns and the indexes the listing sorts on.
+
+    Run by download_images.setup_database; `python book_catalog.py`
+    applies it to an existing database.
+    """
+    # table_info leaves out generated columns, table_xinfo lists them
+    columns = [row[1] for row in conn.execute('PRAGMA table_xinfo(products)')]
+    for column, definition in SORT_KEY_COLUMNS.items():
+        if column not in columns:
+            conn.execute(f'ALTER TABLE products ADD COLUMN {column} {definition}')
+    for name, column in SORT_COLUMNS.items():
+        conn.execute(f'''
+        CREATE INDEX IF NOT EXISTS idx_products_listed_{name}
+        ON products ({column}, id) WHERE local_image_path IS NOT NULL
+        ''')
+    conn.commit()
+
+class ConnectionPool:
+    """A few read connections to one database, shared by all threads.
+
+    connection() lends an idle connection, opening a new one while fewer
+    than size exist and otherwise waiting for one to be returned.
+    """
+
+    def __init__(self, db_path, size=4):
+        self.db_path = db_path
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+        self.lock = threading.Lock()
+        self.data_versions = {}  # id(connection) -> data_version last seen
+        self.sort_columns = None
+
+    def open(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        if self.sort_columns is None:
+            columns = [row[1] for row in conn.execute('PRAGMA table_xinfo(products)')]
+            if all(column in columns for column in SORT_KEY_COLUMNS):
+                self.sort_columns = SORT_COLUMNS
+            else:
+                print(f"{self.db_path} lacks the catalog indexes, run book_catalog.py to add them")
+                self.sort_columns = UNMIGRATED_SORT_COLUMNS
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                can_open = self.opened < self.size
+                if can_open:
+                    self.opened += 1
+            conn = self.open() if can_open else self.idle.get()
+        try:
+            yield conn
+        finally:
+            self.idle.put(conn)
+
+    def changed(self, conn):
+        """Whether another connection committed since conn last asked.
+
+        PRAGMA data_version only compares calls on one connection, so the
+        value seen is kept per connection.
+        """
+        data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+        previous = self.data_versions.get(id(conn))
+        self.data_versions[id(conn)] = data_version
+        return previous != data_version
+
+def get_pool(db_path):
+    """The shared ConnectionPool of db_path, created on first use"""
+    with _pools_lock:
+        if db_path not in _pools:
+            _pools[db_path] = ConnectionPool(db_path, Config.CATALOG_POOL_SIZE)
+        return _pools[db_path]
+
+def _count_listed_books(pool, conn):
+    # The catalog connections only read, so any commit comes from elsewhere
+    # (an ingest run) and shows up as a changed data_version
+    changed = pool.changed(conn)
+    with _counts_lock:
+        count = _counts.get(pool.db_path)
+    if count is None or changed:
+        count = conn.execute('SELECT COUNT(*) FROM products WHERE local_image_path IS NOT NULL').fetchone()[0]
+        with _counts_lock:
+            _counts[pool.db_path] = count
+    return count
+
+def count_listed_books(db_path):
+    """Number of products with a cover, cached until the database changes"""
+    pool = get_pool(db_path)
+    with pool.connection() as conn:
+        return _count_listed_books(pool, conn)
+
+def encode_cursor(key, product_id):
+    raw = json.dumps([key, product_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Return (key, id) from encode_cursor output, or None if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        key, product_id = json.loads(raw)
+        return key, int(product_id)
+    except (ValueError, TypeError):
+        return None
+
+def list_books(db_path, sort_by='name', sort_order='asc', page=1, per_page=15, after=None, before=None):
+    """Return one page of listed products and cursors to its neighbours.
+
+    after / before are cursors from a previous page; with one of them the
+    page is found by seeking the sort index (keyset pagination), which
+    costs the same on every page. Without a cursor, page is located by
+    skipping entries of the index. Returns a dict with rows (id, title,
+    price, vendor, local_image_path, url, labels), page, total_pages,
+    next_cursor and prev_cursor.
+    """
+    pool = get_pool(db_path)
+    with pool.connection() as conn:
+        return _list_books(pool, conn, sort_by, sort_order, page, per_page, after, before)
+
+def _list_books(pool, conn, sort_by, sort_order, page, per_page, after, before):
+    column = pool.sort_columns.get(sort_by, pool.sort_columns['name'])
+    descending = sort_order.lower() == 'desc'
+
+    total_books = _count_listed_books(pool, conn)
+    total_pages = max(1, (total_books + per_page - 1) // per_page)
+    page = min(max(page, 1), total_pages)
+
+    direction = 'DESC' if descending else 'ASC'
+    reverse = 'ASC' if descending else 'DESC'
+    select = f'''
+    SELECT id, title, price, vendor, local_image_path, url, labels, {column}
+    FROM products
+    WHERE local_image_path IS NOT NULL
+    '''
+    after = decode_cursor(after) if after else None
+    before = decode_cursor(before) if before else None
+    if after is not None:
+        rows = conn.execute(f'''
+        {select} AND ({column}, id) {'<' if descending else '>'} (?, ?)
+        ORDER BY {column} {direction}, id {direction} LIMIT ?
+        ''', (*after, per_page)).fetchall()
+    elif before is not None:
+        rows = conn.execute(f'''
+        {select} AND ({column}, id) {'>' if descending else '<'} (?, ?)
+        ORDER BY {column} {reverse}, id {reverse} LIMIT ?
+        ''', (*before, per_page)).fetchall()[::-1]
+    else:
+        rows = conn.execute(f'''
+        {select}
+        ORDER BY {column} {direction}, id {direction} LIMIT ? OFFSET ?
+        ''', (per_page, (page - 1) * per_page)).fetchall()
+
+    return {
+        'rows': [row[:7] for row in rows],
+        'page': page,
+        'total_pages': total_pages,
+        'next_cursor': encode_cursor(rows[-1][7], rows[-1][0]) if rows and page < total_pages else None,
+        'prev_cursor': encode_cursor(rows[0][7], rows[0][0]) if rows and page > 1 else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Add the columns and indexes the /books listing sorts on')
+    parser.add_argument('--db', default=Config.DATABASE_PATH)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    setup_catalog(conn)
+    conn.close()
+    print(f"Catalog indexes are in place in {args.db}")
+
+if __name__ == '__main__':
+    main()
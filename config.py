@@ -15,10 +15,56 @@ class Config:
     IMAGES_DIR = os.getenv('IMAGES_DIR', 'public')
     UPLOAD_DIR = os.getenv('UPLOAD_DIR', 'uploads')
 
+    # Database settings
+    SQLALCHEMY_DATABASE_URI = f'sqlite:///{DATABASE_PATH}'
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    CATALOG_POOL_SIZE = int(os.getenv('CATALOG_POOL_SIZE', 4))  # connections shared by /books requests
+
     # File upload settings
     MAX_CONTENT_LENGTH = int(os.getenv('MAX_CONTENT_LENGTH', 16777216))  # 16MB in bytes
     ALLOWED_EXTENSIONS = set(os.getenv('ALLOWED_EXTENSIONS', 'png,jpg,jpeg,webp').split(','))
 
+    # Rendering settings
+    RENDER_BACKEND = os.getenv('RENDER_BACKEND', 'thread')  # 'thread' or 'process'
+    RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', os.cpu_count() or 1))
+
+    # Quick previews share the tile assignment with the full render
+    PREVIEW_WIDTH = int(os.getenv('PREVIEW_WIDTH', 250))
+    ASSIGNMENT_CACHE_ITEMS = int(os.getenv('ASSIGNMENT_CACHE_ITEMS', 64))
+
+    # Cells and tiles are matched on a MATCH_REGIONS x MATCH_REGIONS grid of
+    # Lab colors (1: mean color only, the default; 3 matches layout as well),
+    # optionally reduced by PCA (0: off)
+    MATCH_REGIONS = int(os.getenv('MATCH_REGIONS', 1))
+    MATCH_PCA_COMPONENTS = int(os.getenv('MATCH_PCA_COMPONENTS', 0))
+    # Tile reuse limits: uses per tile (0: unlimited) and the number of cells
+    # that must separate two copies of a tile (0: off)
+    TILE_MAX_USES = int(os.getenv('TILE_MAX_USES', 0))
+    TILE_MIN_REPEAT_DISTANCE = int(os.getenv('TILE_MIN_REPEAT_DISTANCE', 0))
+
+    # Background render jobs
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', 1))
+    JOB_QUEUE_DEPTH = int(os.getenv('JOB_QUEUE_DEPTH', 8))  # queued + running jobs
+    JOB_TTL = int(os.getenv('JOB_TTL', 600))  # seconds a finished result is kept
+
+    # Tiles whose perceptual hashes differ in at most this many of 64 bits
+    # count as one image; -1 keeps every image
+    DEDUPE_MAX_DISTANCE = int(os.getenv('DEDUPE_MAX_DISTANCE', 6))
+    # ... and whose mean colors are within this CIE Lab distance
+    DEDUPE_MAX_COLOR_DISTANCE = float(os.getenv('DEDUPE_MAX_COLOR_DISTANCE', 5))
+
+    # Tile pyramid cache
+    TILE_CACHE_DIR = os.getenv('TILE_CACHE_DIR', 'cache/tiles')
+    TILE_CACHE_MAX_BYTES = int(os.getenv('TILE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+    # Rendered result cache
+    RESULT_CACHE_ITEMS = int(os.getenv('RESULT_CACHE_ITEMS', 32))  # in-memory entries
+    RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR', 'cache/results')
+    RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+    # Pre-sized book cover thumbnails
+    THUMBNAIL_DIR = os.getenv('THUMBNAIL_DIR', 'cache/thumbnails')
+
     # Server settings
     HOST = os.getenv('HOST', '0.0.0.0')
     PORT = int(os.getenv('PORT', 5000))
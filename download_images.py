@@ -1,11 +1,21 @@
+import argparse
 import json
+import queue
 import sqlite3
 import os
-import requests
+import threading
+import time
+import cv2
+import numpy as np
 from urllib.parse import urljoin
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
+from tile_features import STORE_FEATURES, compute_tile_features, setup_feature_table
+from book_catalog import setup_catalog
+from config import Config
+from http_session import HostLimiter, make_session
+from thumbnails import write_derivatives
 
 # add a clean db
 def clean_db():
@@ -23,9 +33,9 @@ def clean_db():
         images_dir.rmdir()
         print("Cleaned images directory")
 
-def setup_database():
+def setup_database(db_path='mph_images.db'):
     # Create database connection
-    conn = sqlite3.connect('mph_images.db')
+    conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
     # Create table for products
@@ -54,54 +64,318 @@ def setup_database():
     )
     ''')
     
+    # Validators of every downloaded file, for conditional requests on rerun
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS image_downloads (
+        local_path TEXT PRIMARY KEY,
+        url TEXT,
+        etag TEXT,
+        last_modified TEXT,
+        file_size INTEGER,
+        checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    
+    # One row per ingest run plus the outcome of each of its images, so an
+    # interrupted run can be resumed
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS ingest_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        source TEXT,
+        started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        finished_at TIMESTAMP,  -- NULL while running or after an interruption
+        total INTEGER,
+        downloaded INTEGER,
+        not_modified INTEGER,
+        skipped INTEGER,
+        failed INTEGER
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS ingest_run_items (
+        run_id INTEGER,
+        local_path TEXT,
+        status TEXT,  -- downloaded, not_modified, skipped or failed
+        PRIMARY KEY (run_id, local_path),
+        FOREIGN KEY (run_id) REFERENCES ingest_runs (id)
+    )
+    ''')
+    
+    # Tile features are computed while images are downloaded
+    setup_feature_table(conn)
+    setup_catalog(conn)
+    
     conn.commit()
     return conn, cursor
 
-def download_image(args):
-    """Download a single image"""
-    url, save_path, product_id, image_type, conn = args
+# Statuses that count as done when a run is resumed
+COMPLETED_STATUSES = ('downloaded', 'not_modified', 'skipped')
+
+def start_run(conn, source, resume=False):
+    """Return the id of a new ingest run, or of the last unfinished one to resume"""
+    if resume:
+        row = conn.execute('''
+        SELECT id FROM ingest_runs WHERE finished_at IS NULL ORDER BY id DESC LIMIT 1
+        ''').fetchone()
+        if row is not None:
+            print(f"Resuming ingest run {row[0]}")
+            return row[0]
+    cursor = conn.execute('INSERT INTO ingest_runs (source) VALUES (?)', (source,))
+    conn.commit()
+    return cursor.lastrowid
+
+def finish_run(conn, run_id):
+    """Record the run's totals and mark it finished"""
+    counts = dict(conn.execute('''
+    SELECT status, COUNT(*) FROM ingest_run_items WHERE run_id = ? GROUP BY status
+    ''', (run_id,)).fetchall())
+    conn.execute('''
+    UPDATE ingest_runs
+    SET finished_at = CURRENT_TIMESTAMP, total = ?, downloaded = ?, not_modified = ?, skipped = ?, failed = ?
+    WHERE id = ?
+    ''', (sum(counts.values()), counts.get('downloaded', 0), counts.get('not_modified', 0),
+          counts.get('skipped', 0), counts.get('failed', 0), run_id))
+    conn.commit()
+    return counts
+
+def is_valid_image(path, expected_size=None):
+    """Cheap check that a local file is a complete image.
+
+    With a recorded size only the size is compared; otherwise the file is
+    decoded once.
+    """
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return False
+    if size == 0:
+        return False
+    if expected_size is not None:
+        return size == expected_size
+    return cv2.imread(str(path)) is not None
+
+def plan_downloads(download_tasks, conn, run_id, revalidate=False):
+    """Split tasks into work for this run and images that can be skipped.
+
+    Returns (fetch, skipped). fetch holds (task, etag, last_modified)
+    where the validators are set when a valid local copy exists and the
+    server should be asked whether it changed. Images already completed
+    by this run, or with a valid local file when not revalidating, are
+    skipped.
+    """
+    done = {row[0] for row in conn.execute(f'''
+    SELECT local_path FROM ingest_run_items
+    WHERE run_id = ? AND status IN ({', '.join('?' * len(COMPLETED_STATUSES))})
+    ''', (run_id, *COMPLETED_STATUSES))}
+    known = {row[0]: row[1:] for row in conn.execute('''
+    SELECT local_path, url, etag, last_modified, file_size FROM image_downloads
+    ''')}
+    
+    fetch, skipped = [], []
+    for task in download_tasks:
+        url, save_path = task[0], str(task[1])
+        if save_path in done and os.path.exists(save_path):
+            continue
+        
+        recorded_url, etag, last_modified, file_size = known.get(save_path, (None, None, None, None))
+        if recorded_url not in (None, url) or not is_valid_image(save_path, file_size):
+            # Missing, broken or replaced upstream: download unconditionally
+            fetch.append((task, None, None))
+        elif revalidate and (etag or last_modified):
+            fetch.append((task, etag, last_modified))
+        else:
+            skipped.append(task)
+    return fetch, skipped
+
+class DatabaseWriter:
+    """Single writer thread that applies row updates in batched commits.
+
+    Download threads only put() rows on a queue; one connection owned by
+    the writer thread runs them with executemany once batch_size rows are
+    waiting or flush_interval seconds have passed.
+    """
+
+    STATEMENTS = {
+        'featured': ['''
+        UPDATE products 
+        SET local_image_path = ?, original_image_url = ?
+        WHERE id = ?
+        '''],
+        # Reruns update the existing row for a file instead of adding another
+        'additional': ['''
+        UPDATE product_images SET image_url = ?2, product_id = ?3 WHERE local_path = ?1
+        ''', '''
+        INSERT INTO product_images (local_path, image_url, product_id)
+        SELECT ?1, ?2, ?3 WHERE NOT EXISTS (SELECT 1 FROM product_images WHERE local_path = ?1)
+        '''],
+        'validators': ['''
+        INSERT OR REPLACE INTO image_downloads (local_path, url, etag, last_modified, file_size, checked_at)
+        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        '''],
+        'features': [STORE_FEATURES],
+        'run_item': ['''
+        INSERT OR REPLACE INTO ingest_run_items (run_id, local_path, status)
+        VALUES (?, ?, ?)
+        '''],
+    }
+
+    def __init__(self, db_path='mph_images.db', batch_size=200, flush_interval=1.0):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.rows_written = 0
+        self.thread = threading.Thread(target=self.run, name='db-writer', daemon=True)
+        self.thread.start()
+
+    def put(self, kind, row):
+        self.queue.put((kind, row))
+
+    def run(self):
+        conn = sqlite3.connect(self.db_path)
+        pending = {}
+        count = 0
+        deadline = time.monotonic() + self.flush_interval
+        done = False
+        while not done:
+            try:
+                item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                if item is None:
+                    done = True
+                else:
+                    kind, row = item
+                    pending.setdefault(kind, []).append(row)
+                    count += 1
+            except queue.Empty:
+                pass
+            
+            if done or count >= self.batch_size or time.monotonic() >= deadline:
+                if count:
+                    for kind, rows in pending.items():
+                        for statement in self.STATEMENTS[kind]:
+                            conn.executemany(statement, rows)
+                    conn.commit()
+                    self.rows_written += count
+                pending = {}
+                count = 0
+                deadline = time.monotonic() + self.flush_interval
+        conn.close()
+
+    def close(self):
+        """Flush the remaining rows and stop the writer thread"""
+        self.queue.put(None)
+        self.thread.join()
+
+def download_image(task, session, host_limiter, writer, run_id, etag=None, last_modified=None, timeout=30,
+                   thumbnails_dir=None):
+    """Download a single image, or confirm the local copy with a conditional GET.
+
+    A downloaded image is decoded once from the received bytes to store
+    its tile features and thumbnail, so rendering never has to decode it
+    for matching, and to write its cover thumbnails into thumbnails_dir
+    (skipped when None). A response that does not decode is discarded.
+    Returns the status recorded in the run manifest; 'downloaded' only
+    once the file, its rows and its thumbnails are all in place.
+    """
+    url, save_path, product_id, image_type = task
+    status = 'failed'
+    tmp_path = f"{save_path}.part"
     try:
         # Create directory if it doesn't exist
         os.makedirs(os.path.dirname(save_path), exist_ok=True)
         
-        # Download the image
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        
-        # Save the image
-        with open(save_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
         
-        # Update database in a thread-safe way
-        with sqlite3.connect('mph_images.db') as thread_conn:
-            cursor = thread_conn.cursor()
-            if image_type == 'featured':
-                cursor.execute('''
-                UPDATE products 
-                SET local_image_path = ?, original_image_url = ?
-                WHERE id = ?
-                ''', (str(save_path), url, product_id))
-            else:
-                cursor.execute('''
-                INSERT INTO product_images (product_id, image_url, local_path)
-                VALUES (?, ?, ?)
-                ''', (product_id, url, str(save_path)))
-            thread_conn.commit()
+        # Download the image into a temporary file so a failed transfer
+        # never leaves a truncated image behind
+        data = img = None
+        with host_limiter(url):
+            with session.get(url, stream=True, timeout=timeout, headers=headers) as response:
+                response.raise_for_status()
+                if response.status_code != 304:
+                    data = bytearray()
+                    with open(tmp_path, 'wb') as f:
+                        for chunk in response.iter_content(chunk_size=65536):
+                            f.write(chunk)
+                            data += chunk
+                etag = response.headers.get('ETag', etag)
+                last_modified = response.headers.get('Last-Modified', last_modified)
+        if data is not None:
+            # Only a decodable image replaces the local copy
+            img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+            if img is None:
+                raise ValueError("response is not a decodable image")
+            os.replace(tmp_path, save_path)
+            writer.put('features', compute_tile_features(str(save_path), img))
         
-        return True
+        # Hand the database updates to the writer thread
+        writer.put(image_type, (str(save_path), url, product_id))
+        writer.put('validators', (str(save_path), url, etag, last_modified, os.path.getsize(save_path)))
+        if img is not None and thumbnails_dir is not None:
+            write_derivatives(img, save_path, thumbnails_dir)
+        status = 'downloaded' if img is not None else 'not_modified'
     except Exception as e:
         print(f"Error downloading image {url}: {e}")
-        return False
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    writer.put('run_item', (run_id, str(save_path), status))
+    return status
+
+def download_all(download_tasks, db_path='mph_images.db', workers=10, per_host=6, retries=3, backoff=0.5, timeout=30,
+                 run_id=None, revalidate=False, thumbnails_dir=None):
+    """Download every (url, save_path, product_id, image_type) task.
+
+    Valid local files are skipped (or revalidated with conditional GETs
+    when revalidate is set), and images already finished by run_id are
+    left alone so an interrupted run can be resumed. Returns the count of
+    each manifest status.
+    """
+    conn = sqlite3.connect(db_path)
+    if run_id is None:
+        run_id = start_run(conn, 'download_all')
+    fetch, skipped = plan_downloads(download_tasks, conn, run_id, revalidate)
+    conn.close()
+    print(f"{len(fetch)} images to fetch, {len(skipped)} up to date, "
+          f"{len(download_tasks) - len(fetch) - len(skipped)} already done in this run")
+    
+    session = make_session(workers, retries, backoff)
+    host_limiter = HostLimiter(per_host)
+    writer = DatabaseWriter(db_path)
+    counts = {}
+    try:
+        # Skipped files still get their rows, the products may be new
+        for task in skipped:
+            writer.put(task[3], (str(task[1]), task[0], task[2]))
+            writer.put('run_item', (run_id, str(task[1]), 'skipped'))
+        counts['skipped'] = len(skipped)
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(download_image, task, session, host_limiter, writer, run_id,
+                                       etag, last_modified, timeout, thumbnails_dir)
+                       for task, etag, last_modified in fetch]
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                status = future.result()
+                counts[status] = counts.get(status, 0) + 1
+    finally:
+        writer.close()
+        session.close()
+    return counts
 
-def process_products(json_file, conn, cursor):
+def process_products(json_file, conn, cursor, db_path='mph_images.db', images_dir='images', resume=False, **download_options):
     # Create images directory
-    images_dir = Path('images')
+    images_dir = Path(images_dir)
     images_dir.mkdir(exist_ok=True)
     
-    # Read JSON file
+    # Read JSON file (a JSON array, or JSON Lines as written by scrape_mph)
     with open(json_file, 'r', encoding='utf-8') as f:
-        products = json.load(f)
+        if str(json_file).endswith('.jsonl'):
+            products = [json.loads(line) for line in f if line.strip()]
+        else:
+            products = json.load(f)
     
     # Prepare download tasks
     download_tasks = []
@@ -114,10 +388,17 @@ def process_products(json_file, conn, cursor):
             # Convert price to integer cents
             price = product['price'] if product.get('price') else 0
             
-            # Insert product into database
+            # Insert the product, or refresh it if an earlier run stored it
             cursor.execute('''
             INSERT INTO products (id, title, handle, price, vendor, url, labels)
             VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                title = excluded.title,
+                handle = excluded.handle,
+                price = excluded.price,
+                vendor = excluded.vendor,
+                url = excluded.url,
+                labels = excluded.labels
             ''', (
                 product['id'],
                 product['title'],
@@ -132,17 +413,18 @@ def process_products(json_file, conn, cursor):
             if product.get('featured_image'):
                 featured_image_url = urljoin('https://mphonline.com/cdn/shop/', product['featured_image'])
                 local_path = images_dir / f"{product['id']}_featured.jpg"
-                download_tasks.append((featured_image_url, local_path, product['id'], 'featured', conn))
+                download_tasks.append((featured_image_url, local_path, product['id'], 'featured'))
             
             # Process additional images
             for img in product.get('images', []):
                 if img.get('src'):
                     image_url = urljoin('https:', img['src'])
                     local_path = images_dir / f"{product['id']}_{img['id']}.jpg"
-                    download_tasks.append((image_url, local_path, product['id'], 'additional', conn))
+                    download_tasks.append((image_url, local_path, product['id'], 'additional'))
             
             print(f"Queued product: {product['title']}")
             
+            
         except Exception as e:
             print(f"Error processing product {product.get('title')}: {e}")
             conn.rollback()
@@ -151,19 +433,38 @@ def process_products(json_file, conn, cursor):
         conn.commit()
     
     # Download images in parallel
-    print(f"\nDownloading {len(download_tasks)} images...")
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = [executor.submit(download_image, task) for task in download_tasks]
-        for future in tqdm(as_completed(futures), total=len(futures)):
-            future.result()
+    run_id = start_run(conn, str(json_file), resume)
+    print(f"\nChecking {len(download_tasks)} images...")
+    download_all(download_tasks, db_path, run_id=run_id, **download_options)
+    counts = finish_run(conn, run_id)
+    print("Ingest run {}: {}".format(run_id, ', '.join(f"{count} {status}" for status, count in sorted(counts.items()))))
 
 def main():
+    parser = argparse.ArgumentParser(description='Download product images listed in the scraped JSON')
+    parser.add_argument('--json', default='mph_products.json', help='scraped products file')
+    parser.add_argument('--db', default='mph_images.db', help='SQLite database to fill')
+    parser.add_argument('--images-dir', default='images')
+    parser.add_argument('--workers', type=int, default=10, help='concurrent downloads')
+    parser.add_argument('--per-host', type=int, default=6, help='concurrent downloads per host')
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--backoff', type=float, default=0.5, help='base retry delay in seconds')
+    parser.add_argument('--timeout', type=float, default=30, help='per request timeout in seconds')
+    parser.add_argument('--revalidate', action='store_true',
+                        help='ask the server whether existing images changed (ETag / Last-Modified)')
+    parser.add_argument('--resume', action='store_true', help='continue the last interrupted run')
+    parser.add_argument('--thumbnails-dir', default=Config.THUMBNAIL_DIR,
+                        help='where cover thumbnails of downloaded images are written')
+    args = parser.parse_args()
+    
     # Setup database
-    conn, cursor = setup_database()
+    conn, cursor = setup_database(args.db)
     
     try:
         # Process products from JSON file
-        process_products('mph_products.json', conn, cursor)
+        process_products(args.json, conn, cursor, args.db, args.images_dir, resume=args.resume,
+                         workers=args.workers, per_host=args.per_host, retries=args.retries,
+                         backoff=args.backoff, timeout=args.timeout, revalidate=args.revalidate,
+                         thumbnails_dir=args.thumbnails_dir)
         print("All products processed successfully!")
         
     except Exception as e:
@@ -1,12 +1,27 @@
+import argparse
+import csv
+import glob
+import hashlib
+import json
 import cv2
 import numpy as np
 import os
 import sqlite3
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
 from tqdm import tqdm
+import threading
 import time
 from config import Config
+from tile_features import load_tile_features, resolve_image_path, library_version
+from tile_matcher import PCA, build_tile_index, region_descriptors
+from tile_assigner import assign_tiles
+from tile_atlas import build_tile_atlas, letterbox_tile
+from tile_cache import load_tile_atlas
+from tile_dedupe import dedupe_image_paths
+from strip_writer import STRIP_WRITERS, open_strip_writer
 
 def load_reference_image(reference_path):
     """Load and resize the reference image"""
@@ -15,8 +30,24 @@ def load_reference_image(reference_path):
         raise ValueError(f"Could not load reference image: {reference_path}")
     return img
 
-def get_product_images(db_path=None):
-    """Get all product images from the database"""
+def get_featured_images(db_path=None):
+    """Get the featured cover of every product"""
+    if db_path is None:
+        db_path = Config.DATABASE_PATH
+    
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute('SELECT local_image_path FROM products WHERE local_image_path IS NOT NULL')
+    featured = [resolve_image_path(row[0]) for row in cursor.fetchall()]
+    conn.close()
+    return featured
+
+def get_product_images(db_path=None, dedupe=True):
+    """Get all product images from the database
+
+    Near-duplicates (e.g. an additional shot of the cover) are reduced to
+    one image, preferably the featured cover, unless dedupe is False.
+    """
     if db_path is None:
         db_path = Config.DATABASE_PATH
     
@@ -29,208 +60,552 @@ def get_product_images(db_path=None):
     SELECT local_path FROM product_images WHERE local_path IS NOT NULL
     ''')
     
-    image_paths = [row[0] for row in cursor.fetchall()]
+    image_paths = list(dict.fromkeys(resolve_image_path(row[0]) for row in cursor.fetchall()))
     conn.close()
+    if dedupe:
+        image_paths = dedupe_image_paths(image_paths, db_path, preferred=get_featured_images(db_path))
     return image_paths
 
-def preprocess_images(image_paths, target_size):
-    """Pre-load and resize all product images while maintaining their aspect ratios"""
-    processed_images = []
-    print("Pre-processing images...")
-    
-    for img_path in tqdm(image_paths):
+# load_library results per database and settings: (database stamp, library)
+_libraries = {}
+_libraries_lock = threading.Lock()
+
+# Tile atlases a library keeps loaded, one per cell size
+MAX_LOADED_ATLASES = 8
+
+def _database_stamp(db_path):
+    """Modification time and size of the database and its WAL file"""
+    stamp = []
+    for path in (db_path, f"{db_path}-wal"):
         try:
-            img = cv2.imread(img_path)
-            if img is None:
-                continue
-                
-            # Get original dimensions
-            h, w = img.shape[:2]
-            target_w, target_h = target_size
-            
-            # Calculate scaling to fit within target size while maintaining aspect ratio
-            scale = min(target_w/w, target_h/h)
-            new_w = int(w * scale)
-            new_h = int(h * scale)
-            
-            # Resize image
-            resized = cv2.resize(img, (new_w, new_h))
-            
-            # Calculate padding to center the image
-            pad_x = (target_w - new_w) // 2
-            pad_y = (target_h - new_h) // 2
-            
-            # Create padded version of the image
-            padded = np.zeros((target_h, target_w, 3), dtype=np.float32)
-            padded[pad_y:pad_y+new_h, pad_x:pad_x+new_w] = resized
-            
-            # Calculate average color of the resized image
-            avg_color = np.mean(resized, axis=(0, 1))
-            
-            processed_images.append({
-                'path': img_path,
-                'image': padded,
-                'avg_color': avg_color,
-                'original_size': (w, h),
-                'resized_size': (new_w, new_h),
-                'aspect_ratio': w/h  # Store original aspect ratio
-            })
-        except Exception as e:
-            print(f"Error processing image {img_path}: {e}")
-            continue
-    
-    return processed_images
+            stat = os.stat(path)
+            stamp.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            stamp.append(None)
+    return tuple(stamp)
 
-def find_best_match(processed_images, target_color):
-    """Find the best matching image for a target color"""
-    best_match = None
-    best_diff = float('inf')
+def load_library(db_path=None, dedupe=True):
+    """Load the tile library a render uses, reading the feature store once.
+
+    Returns a dict with the image_paths and features of the (deduplicated)
+    library, their average aspect_ratio, and version: the library version
+    plus the matching settings render_cascade would use. It also keeps the
+    atlases loaded for it, see get_tile_atlas. Pass it to render_cascade
+    to reuse it within a request or a batch.
+    
+    The result is remembered until the database file changes, so repeated
+    requests skip scanning the library. Tiles are only added or replaced
+    by the ingest scripts, which record every file there.
+    """
+    if db_path is None:
+        db_path = Config.DATABASE_PATH
+    
+    settings = (f"r{Config.MATCH_REGIONS}p{Config.MATCH_PCA_COMPONENTS}"
+                f"u{Config.TILE_MAX_USES}d{Config.TILE_MIN_REPEAT_DISTANCE}")
+    key = (os.path.abspath(db_path), dedupe, settings, Config.DEDUPE_MAX_DISTANCE, Config.DEDUPE_MAX_COLOR_DISTANCE)
+    stamp = _database_stamp(db_path)
+    cached = _libraries.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
     
-    for img_data in processed_images:
-        diff = np.sum(np.abs(target_color - img_data['avg_color']))
-        if diff < best_diff:
-            best_diff = diff
-            best_match = img_data
+    image_paths = get_product_images(db_path, dedupe=False)
+    features = load_tile_features(image_paths, db_path)
+    if dedupe:
+        kept = set(dedupe_image_paths([f['path'] for f in features], db_path,
+                                      preferred=get_featured_images(db_path), features=features))
+        features = [f for f in features if f['path'] in kept]
     
-    return best_match
+    library = {
+        'image_paths': [f['path'] for f in features],
+        'features': features,
+        'aspect_ratio': average_aspect_ratio(features),
+        'version': f"{library_version(features)}-{settings}",
+        'atlases': {},
+    }
+    with _libraries_lock:
+        _libraries[key] = (stamp, library)
+    return library
 
-def create_blend_mask(size, overlap):
-    """Create a smooth blending mask for overlapping cells"""
-    mask = np.ones(size, dtype=np.float32)
-    blend_width = int(size[0] * overlap)
-    
-    # Create horizontal blend
-    for i in range(blend_width):
-        alpha = i / blend_width
-        mask[i, :] *= alpha
-        mask[-(i+1), :] *= alpha
-    
-    # Create vertical blend
-    for j in range(blend_width):
-        alpha = j / blend_width
-        mask[:, j] *= alpha
-        mask[:, -(j+1)] *= alpha
+def get_tile_atlas(library, cell_size, db_path=None):
+    """The library's tile atlas for cell_size, loaded once and kept with it
+
+    Atlases come from the on-disk pyramid (see tile_cache.load_tile_atlas)
+    and carry the match indexes built over them, so later renders with the
+    same cell size skip both. Only the MAX_LOADED_ATLASES most recently
+    loaded cell sizes are kept.
+    """
+    atlases = library['atlases']
+    atlas = atlases.get(cell_size)
+    if atlas is None:
+        atlas = load_tile_atlas(library['image_paths'], cell_size, db_path, features=library['features'])
+        with _libraries_lock:
+            while len(atlases) >= MAX_LOADED_ATLASES:
+                del atlases[next(iter(atlases))]
+            atlases[cell_size] = atlas
+    return atlas
+
+def preprocess_images(image_paths, target_size, atlas_path=None):
+    """Pre-load and resize all product images while maintaining their aspect ratios
+
+    Returns a TileAtlas whose tiles are padded to target_size. When
+    atlas_path is given the tiles are written straight into a memory-mapped
+    .npy file there instead of being held in RAM.
+    """
+    print("Pre-processing images...")
+    return build_tile_atlas(image_paths, target_size, atlas_path)
+
+def _blend_ramp(length, blend_width):
+    """1-D fade factors: 0 -> 1 over blend_width pixels at both ends"""
+    ramp = np.ones(length, dtype=np.float32)
+    alpha = (np.arange(blend_width) / max(blend_width, 1)).astype(np.float32)
     
+    # Apply the leading and trailing fades one after the other so they
+    # multiply where they meet, as in the original per-row loops
+    head = np.arange(min(blend_width, length))
+    ramp[head] *= alpha[head]
+    ramp[length - 1 - head] *= alpha[head]
+    return ramp
+
+@lru_cache(maxsize=256)
+def create_blend_mask(size, overlap):
+    """Create a smooth blending mask for overlapping cells
+
+    Returns a read-only (h, w) float32 array shared between cells and
+    requests; index it with [..., None] to weight a 3-channel tile.
+    """
+    cell_h, cell_w = size
+    blend_width = int(cell_h * overlap)
+    mask = _blend_ramp(cell_h, blend_width)[:, None] * _blend_ramp(cell_w, blend_width)[None, :]
+    mask.flags.writeable = False
     return mask
 
+class ResizeCache:
+    """Render-scoped memo of tiles resized to a cell shape.
+
+    Cells only come in a few shapes (the last row and column are one pixel
+    larger), so a tile that wins many cells is resampled once per shape.
+    """
+
+    def __init__(self, tiles):
+        self.tiles = tiles
+        self.entries = {}
+        self.hits = 0
+        self.lookups = 0
+        self.lock = threading.Lock()
+
+    def get(self, tile, cell_w, cell_h):
+        """Return tile resized to (cell_w, cell_h) as float32"""
+        key = (int(tile), cell_w, cell_h)
+        with self.lock:
+            self.lookups += 1
+            resized = self.entries.get(key)
+            if resized is not None:
+                self.hits += 1
+                return resized
+        
+        resized = cv2.resize(self.tiles[tile].astype(np.float32), (cell_w, cell_h))
+        with self.lock:
+            return self.entries.setdefault(key, resized)
+
+    def discard(self, tile):
+        """Forget every resized copy of tile"""
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == tile]:
+                del self.entries[key]
+
 def process_cell(args):
     """Process a single cell in parallel"""
-    i, j, cell_w, cell_h, ref_cell, processed_images, overlap = args
-    avg_color = np.mean(ref_cell, axis=(0, 1))
-    best_match = find_best_match(processed_images, avg_color)
+    i, j, cell_w, cell_h, tile, resize_cache, overlap = args
     
-    if best_match is not None:
-        # Get the resized image with its original aspect ratio
-        resized = best_match['image']
-        
-        # Resize to exact cell dimensions
-        resized = cv2.resize(resized, (cell_w, cell_h))
+    if tile is not None:
+        # Resize the padded tile to exact cell dimensions
+        resized = resize_cache.get(tile, cell_w, cell_h)
         
-        # Create blend mask for the cell
+        # Blend mask for the cell, shared by every cell of this shape
         mask = create_blend_mask((cell_h, cell_w), overlap)
-        mask = np.dstack([mask] * 3)  # Convert to 3 channels
         
         return i, j, resized, mask
     
     return i, j, None, None
 
-def get_average_aspect_ratio(image_paths):
+def average_aspect_ratio(features):
+    """Average aspect ratio of tile feature dicts"""
+    if not features:
+        return 1.0  # Default to square if no valid images
+    
+    return sum(f['aspect_ratio'] for f in features) / len(features)
+
+def get_average_aspect_ratio(image_paths, db_path=None):
     """Calculate the average aspect ratio of all product images"""
-    aspect_ratios = []
-    for img_path in image_paths:
-        try:
-            img = cv2.imread(img_path)
-            if img is None:
-                continue
-            h, w = img.shape[:2]
-            aspect_ratios.append(w/h)
-        except Exception as e:
-            print(f"Error reading image {img_path}: {e}")
-            continue
+    return average_aspect_ratio(load_tile_features(image_paths, db_path))
+
+def get_cell_edges(length, grid_size):
+    """Return start and end pixel of every cell along one axis"""
+    cell = length // grid_size
+    starts = np.arange(grid_size) * cell
+    ends = starts + cell
     
-    if not aspect_ratios:
-        return 1.0  # Default to square if no valid images
+    # The last cell takes one extra pixel when the size does not divide evenly
+    if length - cell * grid_size > 0:
+        ends[-1] += 1
+    return starts, np.minimum(ends, length)
+
+def compute_integral_images(reference_img):
+    """Compute summed-area tables of the pixel values and their squares"""
+    sums, squares = cv2.integral2(reference_img, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+    if sums.ndim == 2:
+        sums, squares = sums[..., None], squares[..., None]
+    return sums, squares
+
+def compute_cell_statistics(integral_images, x_starts, x_ends, y_starts, y_ends):
+    """Return per-channel mean and variance of every cell of a grid.
+
+    Both arrays have shape (rows, columns, channels) and are read from the
+    summed-area tables with four lookups per cell, whatever the cell size.
+    """
+    sums, squares = integral_images
+    
+    def box_sums(table):
+        return (table[np.ix_(y_ends, x_ends)] - table[np.ix_(y_starts, x_ends)]
+                - table[np.ix_(y_ends, x_starts)] + table[np.ix_(y_starts, x_starts)])
     
-    return sum(aspect_ratios) / len(aspect_ratios)
+    areas = np.outer(y_ends - y_starts, x_ends - x_starts)[..., None]
+    means = box_sums(sums) / areas
+    variances = np.maximum(box_sums(squares) / areas - means ** 2, 0.0)
+    return means, variances
 
-def create_photo_cascade(reference_img, processed_images, output_img, horizontal_grid_size=20, vertical_grid_size=None, overlap=0.2):
-    """Create a photo cascade effect using parallel processing with overlapping cells"""
-    # Get reference image dimensions
-    ref_h, ref_w = reference_img.shape[:2]
-    print(f"Reference image dimensions: {ref_w}x{ref_h}")
-    print(f"Provided horizontal grid size: {horizontal_grid_size}")
+def _share_array(array):
+    """Copy an array into a new shared memory block"""
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared[...] = array
+    return shm, shared
+
+def _attach_array(spec):
+    """Map a shared memory block created by _share_array in the parent process"""
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+def render_band(args):
+    """Render one horizontal band of cells into the shared canvas"""
+    specs, band, overlap = args
+    blocks = [_attach_array(spec) for spec in specs]
+    tiles, canvas, weight_sum = (array for _, array in blocks)
+    resize_cache = ResizeCache(tiles)
+    
+    for x1, y1, x2, y2, tile in band:
+        resized = resize_cache.get(tile, x2 - x1, y2 - y1)
+        mask = create_blend_mask((y2 - y1, x2 - x1), overlap)
+        canvas[y1:y2, x1:x2] += resized * mask[..., None]
+        weight_sum[y1:y2, x1:x2] += mask
     
-    # If vertical grid size is not provided, calculate it based on aspect ratio
+    # Views must be released before the blocks can be closed
+    del tiles, canvas, weight_sum
+    resize_cache.tiles = None
+    for shm, _ in blocks:
+        shm.close()
+    return len(band), resize_cache.hits, resize_cache.lookups
+
+def render_bands_in_processes(bands, tiles, output_img, weight_sum, overlap, workers, progress=None):
+    """Render row bands in a process pool sharing tiles and canvas memory.
+
+    Each band covers whole grid rows, so workers write disjoint regions of
+    the shared canvas and need no locking. Only the band's cell list is
+    pickled per task. Returns the summed resize cache (hits, lookups).
+    """
+    hits = lookups = 0
+    blocks, arrays = [], []
+    try:
+        for array in (tiles, output_img.astype(np.float32), weight_sum):
+            shm, shared = _share_array(array)
+            blocks.append(shm)
+            arrays.append(shared)
+        specs = [(shm.name, array.shape, array.dtype.str) for shm, array in zip(blocks, arrays)]
+        
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(render_band, (specs, band, overlap)) for band in bands]
+            with tqdm(total=sum(len(band) for band in bands)) as bar:
+                for future in as_completed(futures):
+                    cells, band_hits, band_lookups = future.result()
+                    hits += band_hits
+                    lookups += band_lookups
+                    bar.update(cells)
+                    if progress is not None:
+                        progress(bar.n / bar.total)
+        
+        output_img[...] = arrays[1]
+        weight_sum[...] = arrays[2]
+    finally:
+        # Views must be released before the blocks can be closed
+        arrays.clear()
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+    return hits, lookups
+
+def resolve_vertical_grid_size(ref_w, ref_h, horizontal_grid_size, vertical_grid_size=None):
+    """Return vertical_grid_size, deriving it from the aspect ratio when not given"""
     if vertical_grid_size is None:
         aspect_ratio = ref_h / ref_w
         vertical_grid_size = int(round(horizontal_grid_size * aspect_ratio))
+    return vertical_grid_size
+
+def compute_region_colors(integral_images, x_starts, x_ends, y_starts, y_ends, regions):
+    """Mean color of a regions x regions grid inside every cell.
+
+    Returns shape (rows, columns, regions, regions, channels), laid out
+    like TileAtlas.region_colors so cells and tiles compare region by region.
+    """
+    def split(starts, ends):
+        # Sub-cell edges; the last sub-cell ends exactly at the cell edge
+        fractions = np.arange(regions + 1)
+        edges = starts[:, None] + ((ends - starts)[:, None] * fractions) // regions
+        return edges[:, :-1].ravel(), edges[:, 1:].ravel()
     
-    print(f"Final grid dimensions: {horizontal_grid_size}x{vertical_grid_size}")
+    sub_x_starts, sub_x_ends = split(x_starts, x_ends)
+    sub_y_starts, sub_y_ends = split(y_starts, y_ends)
+    means, _ = compute_cell_statistics(integral_images, sub_x_starts, sub_x_ends, sub_y_starts, sub_y_ends)
+    rows, columns = len(y_starts), len(x_starts)
+    means = means.reshape(rows, regions, columns, regions, means.shape[2])
+    return means.transpose(0, 2, 1, 3, 4)
+
+def get_tile_index(atlas, metric='l1', regions=1, pca_components=None):
+    """Index of the atlas tiles for match_cells, built once per atlas.
+
+    With regions > 1 it is built over the Lab descriptors of a regions x
+    regions grid per tile (compared by L2, metric is ignored), reduced to
+    pca_components dimensions when given; otherwise over the tile mean
+    colors using metric. Returns the index and the PCA cell descriptors
+    must go through as well (None without one). Both are kept in
+    atlas.indexes, so renders sharing the atlas reuse them.
+    """
+    key = ('regions', regions, pca_components or None) if regions > 1 else ('mean', metric)
+    cached = atlas.indexes.get(key)
+    if cached is None:
+        if regions > 1:
+            tile_descriptors = region_descriptors(atlas.region_colors(regions))
+            pca = PCA(tile_descriptors, pca_components) if pca_components else None
+            if pca is not None:
+                tile_descriptors = pca.transform(tile_descriptors)
+            cached = build_tile_index(tile_descriptors, metric='l2'), pca
+        else:
+            cached = build_tile_index(atlas.mean_colors, metric=metric), None
+        cached = atlas.indexes.setdefault(key, cached)
+    return cached
+
+def match_cells(reference_img, atlas, horizontal_grid_size, vertical_grid_size, metric='l1', tile_index=None, integral_images=None, regions=1, pca_components=None, max_uses=None, min_distance=0, candidates=16):
+    """Return the best atlas tile for every cell as a (rows, columns) array.
+
+    Returns None when the atlas is empty. Cell colors come from the
+    summed-area tables of the reference (computed here unless given).
+    With regions > 1 cells and tiles are compared on a regions x regions
+    grid of Lab colors instead of their mean color (metric is ignored),
+    optionally reduced to pca_components dimensions. Tiles are queried
+    through get_tile_index unless a tile_index built over the same
+    descriptors is passed in.
+    
+    Every cell takes its nearest tile unless max_uses (uses per tile) or
+    min_distance (cells between repeats of a tile) is set; then the
+    candidates nearest tiles of each cell go through
+    tile_assigner.assign_tiles.
+    """
+    ref_h, ref_w = reference_img.shape[:2]
+    x_starts, x_ends = get_cell_edges(ref_w, horizontal_grid_size)
+    y_starts, y_ends = get_cell_edges(ref_h, vertical_grid_size)
+    
+    print("Matching cells...")
+    if len(atlas) == 0:
+        print("No tile images to match against")
+        return None
+    
+    if integral_images is None:
+        integral_images = compute_integral_images(reference_img)
+    
+    # Cells need at least one pixel per region
+    regions = min(regions, int((x_ends - x_starts).min()), int((y_ends - y_starts).min()))
+    if tile_index is None or (regions > 1 and pca_components):
+        cached_index, pca = get_tile_index(atlas, metric, regions, pca_components)
+        if tile_index is None:
+            tile_index = cached_index
+    if regions > 1:
+        # Lab descriptors of a grid of regions per cell, compared by L2
+        cell_regions = compute_region_colors(integral_images, x_starts, x_ends, y_starts, y_ends, regions)
+        queries = region_descriptors(cell_regions.reshape((-1,) + cell_regions.shape[2:]))
+        if pca_components:
+            queries = pca.transform(queries)
+    else:
+        cell_means, _ = compute_cell_statistics(integral_images, x_starts, x_ends, y_starts, y_ends)
+        queries = cell_means.reshape(-1, cell_means.shape[2])
     
-    # Calculate consistent cell dimensions
-    cell_w = ref_w // horizontal_grid_size
-    cell_h = ref_h // vertical_grid_size
+    if max_uses or min_distance:
+        def query_cell(cell, k):
+            cell_distances, cell_indices = tile_index.query(queries[cell:cell + 1], k=k)
+            return cell_distances[0], cell_indices[0]
+        
+        distances, indices = tile_index.query(queries, k=candidates)
+        return assign_tiles(distances, indices, (vertical_grid_size, horizontal_grid_size),
+                            max_uses or None, min_distance, query_cell)
+    matches = tile_index.query(queries, k=1)[1][:, 0]
+    return matches.reshape(vertical_grid_size, horizontal_grid_size)
+
+def create_photo_cascade(reference_img, atlas, output_img, horizontal_grid_size=20, vertical_grid_size=None, overlap=0.2, metric='l1', tile_index=None, integral_images=None, backend='thread', workers=None, progress=None, assignment=None, regions=1, pca_components=None, max_uses=None, min_distance=0):
+    """Create a photo cascade effect using parallel processing with overlapping cells
+
+    All cells are matched against the tile library in one batch query of
+    tile_index (see tile_matcher). When no index is passed a default one is
+    built over the atlas mean colors using metric ('l1', 'l2' or 'lab').
+    Cell colors come from integral_images; pass the result of
+    compute_integral_images to reuse it across several grid sizes.
+    backend='process' renders row bands in a process pool over shared
+    memory instead of the default thread pool. progress, if given, is
+    called as progress(stage, fraction) for the 'match' and 'render' stages.
+    A precomputed (rows, columns) assignment of atlas indices skips matching.
+    regions and pca_components select region descriptors, and max_uses and
+    min_distance limit tile reuse; see match_cells.
+    
+    Returns a dict of run stats (cell count, resize cache hit rate and the
+    assignment used).
+    """
+    report = progress or (lambda stage, fraction: None)
+    if backend not in ('thread', 'process'):
+        raise ValueError(f"Unknown render backend '{backend}', expected 'thread' or 'process'")
+    if workers is None:
+        workers = os.cpu_count()
+    
+    # Get reference image dimensions
+    ref_h, ref_w = reference_img.shape[:2]
+    print(f"Reference image dimensions: {ref_w}x{ref_h}")
+    print(f"Provided horizontal grid size: {horizontal_grid_size}")
+    
+    vertical_grid_size = resolve_vertical_grid_size(ref_w, ref_h, horizontal_grid_size, vertical_grid_size)
+    print(f"Final grid dimensions: {horizontal_grid_size}x{vertical_grid_size}")
     
-    # Calculate remaining pixels to distribute
-    remaining_w = ref_w - (cell_w * horizontal_grid_size)
-    remaining_h = ref_h - (cell_h * vertical_grid_size)
+    # Cell boundaries along each axis
+    x_starts, x_ends = get_cell_edges(ref_w, horizontal_grid_size)
+    y_starts, y_ends = get_cell_edges(ref_h, vertical_grid_size)
     
     # Create weight sum array for blending
-    weight_sum = np.zeros_like(reference_img, dtype=np.float32)
-    
-    # Prepare arguments for parallel processing
-    cell_args = []
-    for i in range(horizontal_grid_size):
-        for j in range(vertical_grid_size):
-            # Calculate cell boundaries
-            x1 = i * cell_w
-            y1 = j * cell_h
-            
-            # Add extra pixels to the last cells in each dimension
-            x2 = x1 + cell_w + (1 if i == horizontal_grid_size - 1 and remaining_w > 0 else 0)
-            y2 = y1 + cell_h + (1 if j == vertical_grid_size - 1 and remaining_h > 0 else 0)
-            
-            # Ensure we don't exceed image boundaries
-            x2 = min(x2, ref_w)
-            y2 = min(y2, ref_h)
-            
-            # Calculate actual cell dimensions
-            current_cell_w = x2 - x1
-            current_cell_h = y2 - y1
-            
-            ref_cell = reference_img[y1:y2, x1:x2]
-            cell_args.append((i, j, current_cell_w, current_cell_h, ref_cell, processed_images, overlap))
+    weight_sum = np.zeros(reference_img.shape[:2], dtype=np.float32)
+    
+    # Find the best tile for every cell at once
+    report('match', 0.0)
+    if assignment is None:
+        assignment = match_cells(reference_img, atlas, horizontal_grid_size, vertical_grid_size,
+                                 metric, tile_index, integral_images, regions, pca_components,
+                                 max_uses, min_distance)
+    cells = [(i, j) for i in range(horizontal_grid_size) for j in range(vertical_grid_size)]
     
-    # Process cells in parallel
     print("Processing cells...")
-    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
-        futures = [executor.submit(process_cell, args) for args in cell_args]
+    report('render', 0.0)
+    stats = {'cells': len(cells), 'resize_cache_hits': 0, 'resize_cache_lookups': 0, 'assignment': assignment}
+    if assignment is not None and backend == 'process':
+        bands = []
+        for rows in np.array_split(np.arange(vertical_grid_size), min(workers, vertical_grid_size)):
+            bands.append([(x_starts[i], y_starts[j], x_ends[i], y_ends[j], assignment[j, i])
+                          for j in rows for i in range(horizontal_grid_size)])
+        hits, lookups = render_bands_in_processes(bands, atlas.tiles, output_img, weight_sum, overlap, workers,
+                                                  lambda fraction: report('render', fraction))
+        stats['resize_cache_hits'], stats['resize_cache_lookups'] = hits, lookups
+    elif assignment is not None:
+        # Prepare arguments for parallel processing
+        resize_cache = ResizeCache(atlas.tiles)
+        cell_args = [(i, j, x_ends[i] - x_starts[i], y_ends[j] - y_starts[j], assignment[j, i], resize_cache, overlap)
+                     for i, j in cells]
         
-        for future in tqdm(as_completed(futures), total=len(futures)):
-            i, j, best_match, mask = future.result()
-            if best_match is not None:
-                # Calculate cell position again to ensure consistency
-                x1 = i * cell_w
-                y1 = j * cell_h
-                x2 = x1 + cell_w + (1 if i == horizontal_grid_size - 1 and remaining_w > 0 else 0)
-                y2 = y1 + cell_h + (1 if j == vertical_grid_size - 1 and remaining_h > 0 else 0)
-                
-                # Ensure we don't exceed image boundaries
-                x2 = min(x2, ref_w)
-                y2 = min(y2, ref_h)
-                
-                # Convert best_match to float32 for blending
-                best_match_float = best_match.astype(np.float32)
-                
-                # Apply weighted blending
-                output_img[y1:y2, x1:x2] = output_img[y1:y2, x1:x2].astype(np.float32) + (best_match_float * mask)
-                weight_sum[y1:y2, x1:x2] += mask
+        # Process cells in parallel
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(process_cell, args) for args in cell_args]
+            
+            for done, future in enumerate(tqdm(as_completed(futures), total=len(futures)), 1):
+                report('render', done / len(futures))
+                i, j, best_match, mask = future.result()
+                if best_match is not None:
+                    x1, x2 = x_starts[i], x_ends[i]
+                    y1, y2 = y_starts[j], y_ends[j]
+                    
+                    # Apply weighted blending (best_match is already float32)
+                    output_img[y1:y2, x1:x2] = output_img[y1:y2, x1:x2].astype(np.float32) + (best_match * mask[..., None])
+                    weight_sum[y1:y2, x1:x2] += mask
+        stats['resize_cache_hits'], stats['resize_cache_lookups'] = resize_cache.hits, resize_cache.lookups
+    
+    stats['resize_cache_hit_rate'] = stats['resize_cache_hits'] / max(stats['resize_cache_lookups'], 1)
+    print(f"Resize cache: {stats['resize_cache_hits']}/{stats['resize_cache_lookups']} hits "
+          f"({stats['resize_cache_hit_rate']:.0%})")
     
     # Normalize the output
-    output_img = np.divide(output_img, weight_sum, where=weight_sum > 0)
+    output_img = np.divide(output_img, weight_sum[..., None], where=weight_sum[..., None] > 0)
     output_img = np.clip(output_img, 0, 255).astype(np.uint8)
     
     print("Photo cascade created successfully!")
+    return stats
+
+def create_photo_cascade_streaming(reference_img, atlas, output_path, horizontal_grid_size=20, vertical_grid_size=None, overlap=0.2, output_width=None, metric='l1', tile_index=None, integral_images=None, regions=1, pca_components=None, max_uses=None, min_distance=0, progress=None, assignment=None):
+    """Render a photo cascade straight to disk, one row of cells at a time
+
+    Cells are matched on reference_img exactly as in create_photo_cascade,
+    then drawn at output_width (default: the reference width) so print-size
+    mosaics can be produced from a small reference. Each finished band is
+    appended to output_path (.png, .ppm or .raw, see strip_writer). Cells
+    never overlap, so nothing is carried between bands; peak memory is one
+    band canvas plus the source tiles used by the current and next band,
+    decoded from the full-size images at the output cell size. progress
+    and assignment work as in create_photo_cascade.
+    
+    Returns a dict of run stats like create_photo_cascade.
+    """
+    report = progress or (lambda stage, fraction: None)
+    ref_h, ref_w = reference_img.shape[:2]
+    vertical_grid_size = resolve_vertical_grid_size(ref_w, ref_h, horizontal_grid_size, vertical_grid_size)
+    report('match', 0.0)
+    if assignment is None:
+        assignment = match_cells(reference_img, atlas, horizontal_grid_size, vertical_grid_size,
+                                 metric, tile_index, integral_images, regions, pca_components,
+                                 max_uses, min_distance)
+    
+    if output_width is None:
+        output_width = ref_w
+    output_height = int(round(ref_h * output_width / ref_w))
+    print(f"Streaming {output_width}x{output_height} output to {output_path}")
+    
+    x_starts, x_ends = get_cell_edges(output_width, horizontal_grid_size)
+    y_starts, y_ends = get_cell_edges(output_height, vertical_grid_size)
+    cell_size = (output_width // horizontal_grid_size, output_height // vertical_grid_size)
+    
+    # Source tiles at the output cell size, keyed by atlas index
+    tiles = {}
+    resize_cache = ResizeCache(tiles)
+    stats = {'cells': horizontal_grid_size * vertical_grid_size, 'tiles_decoded': 0, 'assignment': assignment}
+    
+    report('render', 0.0)
+    with open_strip_writer(output_path, output_width, output_height) as writer:
+        for j in tqdm(range(vertical_grid_size) if assignment is not None else []):
+            # Keep only the tiles this band and the next one use
+            needed = set(assignment[j].tolist())
+            upcoming = set(assignment[j + 1].tolist()) if j + 1 < vertical_grid_size else set()
+            for tile in [tile for tile in tiles if tile not in needed | upcoming]:
+                del tiles[tile]
+                resize_cache.discard(tile)
+            for tile in needed - tiles.keys():
+                img = cv2.imread(atlas.tile_path(tile))
+                tiles[tile] = letterbox_tile(img, cell_size) if img is not None else atlas.tiles[tile]
+                stats['tiles_decoded'] += 1
+            
+            band_h = y_ends[j] - y_starts[j]
+            canvas = np.zeros((band_h, output_width, 3), dtype=np.float32)
+            for i in range(horizontal_grid_size):
+                x1, x2 = x_starts[i], x_ends[i]
+                resized = resize_cache.get(assignment[j, i], x2 - x1, band_h)
+                mask = create_blend_mask((band_h, x2 - x1), overlap)
+                canvas[:, x1:x2] += resized * mask[..., None]
+            
+            writer.write_strip(np.clip(canvas, 0, 255).astype(np.uint8))
+            report('render', (j + 1) / vertical_grid_size)
+    
+    stats['resize_cache_hits'], stats['resize_cache_lookups'] = resize_cache.hits, resize_cache.lookups
+    stats['resize_cache_hit_rate'] = resize_cache.hits / max(resize_cache.lookups, 1)
+    print("Photo cascade created successfully!")
+    return stats
 
 def calculate_optimal_grid_size(ref_w, ref_h, product_aspect_ratio, target_horizontal_cells=40):
     """Calculate optimal grid size based on product images' aspect ratio"""
@@ -256,62 +631,282 @@ def calculate_optimal_grid_size(ref_w, ref_h, product_aspect_ratio, target_horiz
     
     return horizontal_cells, vertical_cells
 
-def main():
-    # Paths
-    reference_path = "001.webp"
-    db_path = "mph_images.db"
-    output_path = "photo_cascade.jpg"
+RENDER_STAGES = ('lookup', 'decode', 'query', 'aspect_ratio', 'tiles', 'match', 'render', 'encode')
+
+def prepare_reference(reference_img, width=1000):
+    """Resize the reference image to width pixels, keeping its aspect ratio"""
+    h, w = reference_img.shape[:2]
+    aspect_ratio = h / w
+    new_height = int(width * aspect_ratio)
+    return cv2.resize(reference_img, (width, new_height))
+
+def render_cascade(reference_img, db_path=None, horizontal_grid_size=40, overlap=0, backend='thread', workers=None, progress=None, preview_width=None, assignment=None, regions=None, pca_components=None, max_uses=None, min_distance=None, library=None, output_path=None, output_width=None):
+    """Run the whole pipeline for a prepared reference image
+
+    Loads the tile library, picks the grid from the tiles' average aspect
+    ratio and renders the mosaic. progress, if given, is called as
+    progress(stage, fraction) with stages from RENDER_STAGES.
     
-    try:
-        start_time = time.time()
-        
-        # Load reference image
-        print("Loading reference image...")
-        reference_img = load_reference_image(reference_path)
-        
-        # Upscale reference image to 1000px width while maintaining aspect ratio
-        h, w = reference_img.shape[:2]
-        aspect_ratio = h / w
-        new_width = 1000
-        new_height = int(new_width * aspect_ratio)
-        reference_img = cv2.resize(reference_img, (new_width, new_height))
-        print(f"Resized reference image to {new_width}x{new_height}")
-        
-        # Get product images
-        print("Loading product images from database...")
-        image_paths = get_product_images(db_path)
-        print(f"Found {len(image_paths)} product images")
-        
-        # Calculate average aspect ratio of product images
-        avg_product_aspect_ratio = get_average_aspect_ratio(image_paths)
-        print(f"Average product image aspect ratio: {avg_product_aspect_ratio:.2f}")
-        
-        # Calculate optimal grid size
-        horizontal_grid_size, vertical_grid_size = calculate_optimal_grid_size(
-            new_width, new_height, avg_product_aspect_ratio, target_horizontal_cells=40
+    With preview_width the same grid is drawn at that width from the
+    smallest cached tile level, which is fast enough for an interactive
+    preview. assignment is the (rows, columns) tile choice of an earlier
+    render of the same image and grid (stats['assignment']); passing it
+    skips matching so a preview and its full render use the same tiles.
+    regions, pca_components, max_uses and min_distance default to
+    Config.MATCH_REGIONS, MATCH_PCA_COMPONENTS, TILE_MAX_USES and
+    TILE_MIN_REPEAT_DISTANCE (see match_cells). library is the result of
+    load_library(db_path), loaded here if not given; the tile atlas of
+    each cell size is kept with it (see get_tile_atlas).
+    
+    With output_path the mosaic is drawn at output_width (default: the
+    reference width) and streamed to that file band by band, see
+    create_photo_cascade_streaming, so large outputs never exist in memory.
+    
+    Returns the uint8 mosaic (None when streaming) and the run stats of
+    create_photo_cascade.
+    """
+    report = progress or (lambda stage, fraction: None)
+    ref_h, ref_w = reference_img.shape[:2]
+    if regions is None:
+        regions = Config.MATCH_REGIONS
+    if pca_components is None:
+        pca_components = Config.MATCH_PCA_COMPONENTS
+    if max_uses is None:
+        max_uses = Config.TILE_MAX_USES
+    if min_distance is None:
+        min_distance = Config.TILE_MIN_REPEAT_DISTANCE
+    
+    # Get product images and the grid that suits their aspect ratio
+    report('query', 0.0)
+    if library is None:
+        library = load_library(db_path)
+    report('aspect_ratio', 0.0)
+    avg_product_aspect_ratio = library['aspect_ratio']
+    horizontal_grid_size, vertical_grid_size = calculate_optimal_grid_size(
+        ref_w, ref_h, avg_product_aspect_ratio, horizontal_grid_size
+    )
+    if assignment is not None and assignment.shape != (vertical_grid_size, horizontal_grid_size):
+        assignment = None
+    
+    # Previews keep the grid of the full size render but shrink every cell
+    full_reference_img = reference_img
+    if preview_width is not None and preview_width < ref_w:
+        reference_img = prepare_reference(reference_img, preview_width)
+        ref_h, ref_w = reference_img.shape[:2]
+        backend = 'thread'
+    
+    # Load the tile atlas for this cell size
+    report('tiles', 0.0)
+    cell_size = (max(1, ref_w // horizontal_grid_size), max(1, ref_h // vertical_grid_size))
+    tile_atlas = get_tile_atlas(library, cell_size, db_path)
+    
+    # Cell colors always come from the full size reference
+    if assignment is None and reference_img is not full_reference_img:
+        report('match', 0.0)
+        assignment = match_cells(full_reference_img, tile_atlas, horizontal_grid_size, vertical_grid_size,
+                                 regions=regions, pca_components=pca_components,
+                                 max_uses=max_uses, min_distance=min_distance)
+    
+    if output_path is not None:
+        stats = create_photo_cascade_streaming(
+            reference_img, tile_atlas, output_path, horizontal_grid_size, vertical_grid_size, overlap,
+            output_width, regions=regions, pca_components=pca_components, max_uses=max_uses,
+            min_distance=min_distance, progress=progress, assignment=assignment
         )
-        print(f"Optimal grid dimensions: {horizontal_grid_size}x{vertical_grid_size}")
-        
-        # Calculate cell size based on grid size
-        cell_w = new_width // horizontal_grid_size
-        cell_h = new_height // vertical_grid_size
-        cell_size = (cell_w, cell_h)
-        
-        # Pre-process images
-        processed_images = preprocess_images(image_paths, cell_size)
-        
-        # Create photo cascade with aspect-ratio-aware grid
-        print("Creating photo cascade...")
-        create_photo_cascade(reference_img, processed_images, output_path, 
-                           horizontal_grid_size=horizontal_grid_size,
-                           vertical_grid_size=vertical_grid_size,
-                           overlap=0)
-        
-        end_time = time.time()
-        print(f"Total execution time: {end_time - start_time:.2f} seconds")
+        stats['tiles'] = len(tile_atlas)
+        return None, stats
+    
+    output_img = np.zeros_like(reference_img, dtype=np.float32)
+    stats = create_photo_cascade(
+        reference_img,
+        tile_atlas,
+        output_img,
+        horizontal_grid_size=horizontal_grid_size,
+        vertical_grid_size=vertical_grid_size,
+        overlap=overlap,
+        backend=backend,
+        workers=workers,
+        progress=progress,
+        assignment=assignment,
+        regions=regions,
+        pca_components=pca_components,
+        max_uses=max_uses,
+        min_distance=min_distance
+    )
+    stats['tiles'] = len(tile_atlas)
+    return output_img.astype(np.uint8), stats
+
+# Files picked up when a directory of references is given
+REFERENCE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+SUMMARY_FIELDS = ('reference', 'output', 'status', 'seconds', 'decode', 'tiles', 'match', 'render', 'encode', 'error')
+
+_batch_library = None
+
+def find_references(patterns):
+    """Expand directories and glob patterns into a sorted list of image files"""
+    references = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            references.extend(str(path) for path in Path(pattern).iterdir()
+                              if path.suffix.lower() in REFERENCE_EXTENSIONS)
+        elif glob.has_magic(pattern):
+            references.extend(glob.glob(pattern, recursive=True))
+        else:
+            references.append(pattern)
+    return sorted(dict.fromkeys(references))
+
+def render_stamp(reference_path, settings):
+    """Identifies one render: the reference file's state and every setting"""
+    stat = os.stat(reference_path)
+    raw = json.dumps([os.path.abspath(reference_path), stat.st_mtime_ns, stat.st_size, settings], sort_keys=True)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+def _init_batch_worker(db_path, library):
+    # Each worker keeps the library, and with it its atlases, for the whole batch
+    global _batch_library
+    _batch_library = {'db_path': db_path, 'library': library}
+
+def render_reference(reference_path, output_path, horizontal_grid_size, overlap, width, output_width=None, stream=False):
+    """Render one reference of a batch in a worker; returns its summary row
+
+    The mosaic is drawn at output_width (default: width). It is streamed
+    to disk (see create_photo_cascade_streaming) when stream is set or it
+    is wider than the reference; a narrower one is drawn like a preview.
+    """
+    timings = {}
+    started = time.perf_counter()
+    current = ['decode', started]
+    
+    def lap(stage, fraction=0.0):
+        # render_cascade reports each stage as it starts
+        if stage != current[0]:
+            now = time.perf_counter()
+            timings[current[0]] = round(timings.get(current[0], 0) + now - current[1], 3)
+            current[:] = [stage, now]
+    
+    reference_img = prepare_reference(load_reference_image(reference_path), width)
+    tmp_path = f"{output_path}.tmp{Path(output_path).suffix}"
+    stream = stream or (output_width is not None and output_width > width)
+    
+    # Pool workers already use every core, so each render stays on one thread
+    try:
+        output_img, _ = render_cascade(reference_img, _batch_library['db_path'], horizontal_grid_size, overlap,
+                                       workers=1, progress=lap, library=_batch_library['library'],
+                                       preview_width=None if stream else output_width,
+                                       output_path=tmp_path if stream else None, output_width=output_width)
         
-    except Exception as e:
-        print(f"Error: {e}")
+        lap('encode')
+        if output_img is not None and not cv2.imwrite(tmp_path, output_img):
+            raise ValueError(f"Could not write {output_path}")
+        os.replace(tmp_path, output_path)
+    except Exception:
+        # Never leave a partial output behind
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    lap('done')
+    
+    timings['seconds'] = round(time.perf_counter() - started, 3)
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description='Render photo cascades for many reference images')
+    parser.add_argument('references', nargs='+', help='reference images, directories or glob patterns')
+    parser.add_argument('--output-dir', default='cascades')
+    parser.add_argument('--format', default='jpg', choices=('jpg', 'png', 'webp', 'ppm'))
+    parser.add_argument('--db', default=Config.DATABASE_PATH)
+    parser.add_argument('--grid', type=int, default=40, help='horizontal cells')
+    parser.add_argument('--overlap', type=float, default=0)
+    parser.add_argument('--width', type=int, default=1000, help='reference width after resizing')
+    parser.add_argument('--output-width', type=int,
+                        help='mosaic width (default: --width); wider outputs are streamed to disk')
+    parser.add_argument('--stream', action='store_true',
+                        help='write every output band by band instead of holding it in memory (png or ppm)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='references rendered at once')
+    parser.add_argument('--force', action='store_true', help='render even if the output is up to date')
+    parser.add_argument('--summary', help='CSV of per-image timings (default: OUTPUT_DIR/summary.csv)')
+    args = parser.parse_args()
+    stream = args.stream or (args.output_width is not None and args.output_width > args.width)
+    if stream and f'.{args.format}' not in STRIP_WRITERS:
+        parser.error(f'streamed outputs must be png or ppm, not {args.format}')
+    
+    start_time = time.time()
+    references = find_references(args.references)
+    if not references:
+        parser.error('no reference images found')
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest_path = Path(args.output_dir) / 'manifest.json'
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+    
+    # Load the tile library once for the whole batch
+    print("Loading product images from database...")
+    library = load_library(args.db)
+    settings = [library['version'], args.grid, args.overlap, args.width, args.output_width, stream]
+    print(f"Found {len(library['image_paths'])} product images, average aspect ratio {library['aspect_ratio']:.2f}")
+    
+    # References with the same file name would overwrite each other's output
+    outputs = {}
+    for reference_path in references:
+        output_path = str(Path(args.output_dir) / f"{Path(reference_path).stem}.{args.format}")
+        outputs.setdefault(output_path, []).append(reference_path)
+    clashes = {output_path: paths for output_path, paths in outputs.items() if len(paths) > 1}
+    if clashes:
+        parser.error('references would share an output file: ' +
+                     '; '.join(f"{', '.join(paths)} -> {output_path}" for output_path, paths in clashes.items()))
+    
+    # Outputs whose manifest stamp still matches are up to date
+    rows = []
+    jobs = []
+    for output_path, (reference_path,) in outputs.items():
+        try:
+            stamp = render_stamp(reference_path, settings)
+        except OSError as e:
+            print(f"Error reading {reference_path}: {e}")
+            rows.append({'reference': reference_path, 'output': output_path, 'status': 'failed', 'error': str(e)})
+            continue
+        if not args.force and manifest.get(output_path) == stamp and os.path.exists(output_path):
+            rows.append({'reference': reference_path, 'output': output_path, 'status': 'skipped'})
+        else:
+            jobs.append((reference_path, output_path, stamp))
+    print(f"{len(jobs)} to render, {sum(row['status'] == 'skipped' for row in rows)} up to date")
+    
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, args.workers), initializer=_init_batch_worker,
+                                 initargs=(args.db, library)) as executor:
+            futures = {executor.submit(render_reference, reference_path, output_path,
+                                       args.grid, args.overlap, args.width, args.output_width,
+                                       stream): (reference_path, output_path, stamp)
+                       for reference_path, output_path, stamp in jobs}
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                reference_path, output_path, stamp = futures[future]
+                row = {'reference': reference_path, 'output': output_path}
+                try:
+                    row.update(future.result(), status='rendered')
+                    manifest[output_path] = stamp
+                except Exception as e:
+                    print(f"Error rendering {reference_path}: {e}")
+                    row.update(status='failed', error=str(e))
+                rows.append(row)
+    finally:
+        manifest_path.write_text(json.dumps(manifest, indent=2))
+    
+    # Per-image timings, in reference order
+    rows.sort(key=lambda row: row['reference'])
+    summary_path = args.summary or str(Path(args.output_dir) / 'summary.csv')
+    with open(summary_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+    
+    rendered = [row for row in rows if row['status'] == 'rendered']
+    failed = sum(row['status'] == 'failed' for row in rows)
+    print(f"{len(rendered)} rendered, {len(rows) - len(rendered) - failed} skipped, {failed} failed")
+    if rendered:
+        seconds = sorted(row['seconds'] for row in rendered)
+        print(f"Per image: median {seconds[len(seconds) // 2]:.2f}s, max {seconds[-1]:.2f}s")
+    print(f"Summary written to {summary_path}")
+    print(f"Total execution time: {time.time() - start_time:.2f} seconds")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
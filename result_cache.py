@@ -0,0 +1,114 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+def cascade_cache_key(file_bytes, horizontal_grid_size, overlap, library_version, mode='full'):
+    """Content address of a render: reference bytes, parameters and tile library.
+
+    Parameters are normalised first so that e.g. overlap '0.20' and '0.2'
+    share an entry. mode separates full renders from previews and other
+    derived entries.
+    """
+    digest = hashlib.sha256()
+    digest.update(hashlib.sha256(file_bytes).digest())
+    digest.update(f"|{int(horizontal_grid_size)}|{float(overlap)!r}|{library_version}|{mode}".encode())
+    return digest.hexdigest()
+
+class ResultCache:
+    """Two-tier cache of encoded results keyed by cascade_cache_key.
+
+    The memory tier is an LRU of at most memory_items entries. The disk tier
+    keeps one file per key under cache_dir and evicts the least recently
+    used files once they exceed max_bytes. A disk hit is promoted back into
+    memory. With cache_dir None the cache is memory only and may hold any
+    object, not just bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes, memory_items=32, suffix='.jpg'):
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.suffix = suffix
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}{self.suffix}"
+
+    def _remember(self, key, data):
+        self.memory[key] = data
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    def get(self, key):
+        """Return the cached bytes for key, or None"""
+        with self.lock:
+            data = self.memory.get(key)
+            if data is not None:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return data
+            if self.cache_dir is None:
+                self.misses += 1
+                return None
+
+            path = self._path(key)
+            try:
+                data = path.read_bytes()
+                # Mark the file as recently used for eviction
+                os.utime(path)
+            except OSError:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, data)
+            return data
+
+    def put(self, key, data):
+        """Store data under key in both tiers"""
+        with self.lock:
+            self._remember(key, data)
+            if self.cache_dir is None or self.max_bytes <= 0 or len(data) > self.max_bytes:
+                return
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._path(key)
+            tmp_path = path.with_name(f"{path.name}.tmp{os.getpid()}.{threading.get_ident()}")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+            self.evict(keep=path)
+
+    def evict(self, keep=None):
+        """Remove least recently used files until the disk tier fits max_bytes"""
+        entries = []
+        for path in self.cache_dir.glob(f"*{self.suffix}"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, path, stat.st_size))
+
+        total = sum(size for _, _, size in entries)
+        for _, path, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        hits = self.memory_hits + self.disk_hits
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'memory_items': len(self.memory)
+        }
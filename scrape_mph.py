@@ -1,85 +1,160 @@
-import requests
 import json
-import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from typing import List, Dict
-import os
+from http_session import make_session
 
-def scrape_mph_images(urls: List[Dict[str, str]], output_file: str = 'mph_products.json'):
-    """Scrape multiple MPH URLs and combine the results"""
+# The collection pages embed their products as a JS array passed to this call
+PRODUCTS_MARKER = 'Samita.ProductLabels.products.concat('
+
+# Headers to mimic a browser request
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+_decoder = json.JSONDecoder(strict=False)  # the blob may hold raw newlines and tabs
+
+def extract_products(chunks):
+    """Return the product list embedded in an HTML page given as text chunks.
+
+    The page is scanned as it arrives: nothing before the marker is kept,
+    and reading stops as soon as the array after it has been decoded.
+    Returns None when the page has no product data.
+    """
+    buffer = ''
+    start = -1
+    for chunk in chunks:
+        buffer += chunk
+        if start < 0:
+            index = buffer.find(PRODUCTS_MARKER)
+            if index < 0:
+                # Keep just enough to find a marker split across chunks
+                buffer = buffer[-len(PRODUCTS_MARKER):]
+                continue
+            buffer = buffer[index + len(PRODUCTS_MARKER):]
+            start = 0
+        try:
+            products, _ = _decoder.raw_decode(buffer.lstrip())
+            return products
+        except json.JSONDecodeError:
+            continue  # the array is not complete yet
+    return None
+
+def fetch_page(session, url, page, timeout=30):
+    """Fetch one page of a collection and return its products (None if absent)"""
+    params = {'page': page} if page > 1 else None
+    with session.get(url, headers=HEADERS, params=params, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        response.encoding = response.encoding or 'utf-8'
+        return extract_products(response.iter_content(chunk_size=65536, decode_unicode=True))
+
+class ProductWriter:
+    """Append products to a JSON Lines file, or to a JSON array written as it grows"""
+
+    def __init__(self, output_file):
+        self.jsonl = output_file.endswith('.jsonl')
+        self.file = open(output_file, 'w', encoding='utf-8')
+        self.count = 0
+        self.lock = threading.Lock()
+        if not self.jsonl:
+            self.file.write('[')
+
+    def write(self, product):
+        with self.lock:
+            if self.jsonl:
+                self.file.write(json.dumps(product, ensure_ascii=False) + '\n')
+            else:
+                self.file.write((',\n' if self.count else '\n') + json.dumps(product, indent=4, ensure_ascii=False))
+            self.count += 1
+
+    def close(self):
+        if not self.jsonl:
+            self.file.write('\n]\n')
+        self.file.close()
+
+def scrape_mph_images(urls: List[Dict[str, str]], output_file: str = 'mph_products.json',
+                      workers: int = 8, max_pages: int = 50, retries: int = 3):
+    """Scrape multiple MPH URLs and combine the results
+
+    Collections and their ?page=N pages are fetched concurrently on a
+    pool of workers sharing one keep-alive session. The next page of a
+    collection is queued as soon as the previous one returned products.
+    Unique products are written to output_file as they arrive, as JSON
+    Lines if it ends in .jsonl and as a JSON array otherwise.
+    """
     print(f"Starting to scrape {len(urls)} URLs")
-    
-    # Headers to mimic a browser request
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    
-    all_products = []
+
+    session = make_session(workers, retries)
+    writer = ProductWriter(output_file)
     seen_product_ids = set()  # To avoid duplicates
-    
-    for url_data in urls:
-        url = url_data["url"]
-        label = url_data["label"]
-        print(f"\nProcessing URL: {url} ({label})")
-        try:
-            # Send GET request to the URL
-            print("Sending GET request...")
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            print("Successfully retrieved webpage")
-            
-            # Find the JSON data in the response
-            print("Extracting JSON data...")
-            json_match = re.search(r'Samita\.ProductLabels\.products\s*=\s*Samita\.ProductLabels\.products\.concat\((\[.*?\])\)', response.text, re.DOTALL)
-            
-            if json_match:
-                json_str = json_match.group(1)
-                # Clean up the JSON string
-                json_str = json_str.replace('\n', '').replace('\t', '')
-                products = json.loads(json_str)
-                print(f"Found {len(products)} products")
-                
-                # Process each product
-                for i, product in enumerate(products, 1):
-                    product_id = product.get('id')
-                    if product_id in seen_product_ids:
-                        print(f"Skipping duplicate product {product_id}")
+    collection_ids = {}  # url -> product ids seen on its pages so far
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            def submit(url_data, page):
+                future = executor.submit(fetch_page, session, url_data['url'], page)
+                pending[future] = (url_data, page)
+
+            pending = {}
+            for url_data in urls:
+                submit(url_data, 1)
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url_data, page = pending.pop(future)
+                    url, label = url_data['url'], url_data['label']
+                    try:
+                        products = future.result()
+                    except Exception as e:
+                        print(f"Error occurred while scraping {url} page {page}: {e}")
+                        continue
+
+                    if products is None:
+                        if page == 1:
+                            print(f"Could not find product data in {url}")
+                        continue
+                    if not products:
                         continue
-                        
-                    seen_product_ids.add(product_id)
-                    print(f"\nProcessing product {i}/{len(products)}")
-                    
-                    # Extract relevant information
-                    product_data = {
-                        'id': product_id,
-                        'title': product.get('title'),
-                        'handle': product.get('handle'),
-                        'price': product.get('price'),
-                        'vendor': product.get('vendor'),
-                        'featured_image': product.get('featured_image'),
-                        'url': product.get('url'),
-                        'tags': product.get('tags', []),
-                        'images': product.get('images', []),
-                        'variants': product.get('variants', []),
-                        'source_url': url,  # Track which URL this product came from
-                        'label': label  # Add the label
-                    }
-                    
-                    print(f"Found product: {product_data['title']} - {product_data['price']}")
-                    all_products.append(product_data)
-            else:
-                print("Could not find product data in the page")
-            
-        except requests.exceptions.RequestException as e:
-            print(f"Error occurred while scraping {url}: {e}")
-        except json.JSONDecodeError as e:
-            print(f"Error parsing JSON data from {url}: {e}")
-    
-    # Save the combined data to a JSON file
-    print(f"\nSaving {len(all_products)} unique products to {output_file}...")
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(all_products, f, indent=4, ensure_ascii=False)
-    
-    print(f"Successfully scraped {len(all_products)} unique products and saved to {output_file}")
+
+                    page_ids = {product.get('id') for product in products}
+                    known = collection_ids.setdefault(url, set())
+                    more_pages = not page_ids <= known
+                    known |= page_ids
+
+                    new = 0
+                    for product in products:
+                        product_id = product.get('id')
+                        if product_id in seen_product_ids:
+                            continue
+                        seen_product_ids.add(product_id)
+                        new += 1
+
+                        # Extract relevant information
+                        writer.write({
+                            'id': product_id,
+                            'title': product.get('title'),
+                            'handle': product.get('handle'),
+                            'price': product.get('price'),
+                            'vendor': product.get('vendor'),
+                            'featured_image': product.get('featured_image'),
+                            'url': product.get('url'),
+                            'tags': product.get('tags', []),
+                            'images': product.get('images', []),
+                            'variants': product.get('variants', []),
+                            'source_url': url,  # Track which URL this product came from
+                            'label': label  # Add the label
+                        })
+                    print(f"{label} page {page}: {len(products)} products, {new} new")
+
+                    # A page that only repeats this collection's products is past the end
+                    if more_pages and page < max_pages:
+                        submit(url_data, page + 1)
+    finally:
+        writer.close()
+        session.close()
+
+    print(f"Successfully scraped {writer.count} unique products and saved to {output_file}")
 
 if __name__ == "__main__":
     # Example URLs to scrape
@@ -89,6 +164,6 @@ if __name__ == "__main__":
         {"url": "https://mphonline.com/collections/mph-best-of-2022", "label": "Best of 2022"},
         {"url": "https://mphonline.com/collections/mph-best-of-2021", "label": "Best of 2021"},
     ]
-    
-    
-    scrape_mph_images(urls)
\ No newline at end of file
+
+
+    scrape_mph_images(urls)
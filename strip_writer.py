@@ -0,0 +1,101 @@
+import os
+import struct
+import zlib
+import numpy as np
+
+class StripWriter:
+    """Write an image top to bottom, one strip of rows at a time.
+
+    Strips are BGR uint8 arrays of the full image width; only the strip
+    being written is ever held in memory.
+    """
+
+    def __init__(self, path, width, height):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self.file = open(path, 'wb')
+        self.write_header()
+
+    def write_header(self):
+        pass
+
+    def write_strip(self, strip):
+        if strip.shape[1] != self.width or self.rows_written + strip.shape[0] > self.height:
+            raise ValueError(f"Strip of shape {strip.shape} does not fit a {self.width}x{self.height} image "
+                             f"with {self.rows_written} rows written")
+        self.encode_strip(np.ascontiguousarray(strip[..., ::-1]))  # BGR -> RGB
+        self.rows_written += strip.shape[0]
+
+    def encode_strip(self, rgb):
+        self.file.write(rgb.tobytes())
+
+    def finish(self):
+        pass
+
+    def close(self):
+        """Finish the file; missing rows at the bottom are written as black"""
+        if self.file.closed:
+            return
+        if self.rows_written < self.height:
+            self.write_strip(np.zeros((self.height - self.rows_written, self.width, 3), dtype=np.uint8))
+        self.finish()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.file.close()
+            os.remove(self.path)
+        else:
+            self.close()
+
+class RawStripWriter(StripWriter):
+    """Headerless interleaved RGB bytes"""
+
+class PPMStripWriter(StripWriter):
+    """Binary PPM (P6); the header only needs the final size"""
+
+    def write_header(self):
+        self.file.write(f"P6\n{self.width} {self.height}\n255\n".encode('ascii'))
+
+class PNGStripWriter(StripWriter):
+    """PNG written as a stream of IDAT chunks through one zlib compressor"""
+
+    def _chunk(self, kind, data):
+        self.file.write(struct.pack('>I', len(data)) + kind + data)
+        self.file.write(struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    def write_header(self):
+        self.file.write(b'\x89PNG\r\n\x1a\n')
+        # 8-bit RGB, no interlacing
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', self.width, self.height, 8, 2, 0, 0, 0))
+        self.compressor = zlib.compressobj(6)
+
+    def encode_strip(self, rgb):
+        # Every scanline starts with filter type 0 (None)
+        rows = np.zeros((rgb.shape[0], 1 + self.width * 3), dtype=np.uint8)
+        rows[:, 1:] = rgb.reshape(rgb.shape[0], -1)
+        data = self.compressor.compress(rows.tobytes())
+        if data:
+            self._chunk(b'IDAT', data)
+
+    def finish(self):
+        self._chunk(b'IDAT', self.compressor.flush())
+        self._chunk(b'IEND', b'')
+
+STRIP_WRITERS = {
+    '.png': PNGStripWriter,
+    '.ppm': PPMStripWriter,
+    '.raw': RawStripWriter,
+}
+
+def open_strip_writer(path, width, height):
+    """Pick a StripWriter from the file extension of path"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in STRIP_WRITERS:
+        raise ValueError(f"Unsupported streaming output '{extension}', expected one of {tuple(STRIP_WRITERS)}")
+    return STRIP_WRITERS[extension](path, width, height)
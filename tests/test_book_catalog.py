@@ -0,0 +1,69 @@
+"""Keyset pagination of the /books listing, including rows whose sort key
+is NULL."""
+import pytest
+from book_catalog import decode_cursor, encode_cursor, list_books
+from download_images import setup_database
+
+PRODUCTS = [
+    # id, title, price
+    (1, 'Atlas', 1500),
+    (2, 'Bestiary', None),
+    (3, None, 900),
+    (4, 'Codex', 1500),
+    (5, 'Diary', None),
+    (6, 'Epic', 300),
+    (7, 'Fables', 2500),
+]
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'catalog.db')
+    conn, cursor = setup_database(path)
+    cursor.executemany('INSERT INTO products (id, title, price, local_image_path) VALUES (?, ?, ?, ?)',
+                       [(id, title, price, f'public/{id}.jpg') for id, title, price in PRODUCTS])
+    # Not listed: no cover
+    cursor.execute("INSERT INTO products (id, title, price) VALUES (8, 'Grimoire', 100)")
+    conn.commit()
+    conn.close()
+    return path
+
+def walk(db_path, sort_by, sort_order, per_page=2):
+    """Ids of every page, following next_cursor from the first page"""
+    pages = []
+    result = list_books(db_path, sort_by, sort_order, per_page=per_page)
+    while True:
+        pages.append([row[0] for row in result['rows']])
+        if result['next_cursor'] is None:
+            return pages
+        result = list_books(db_path, sort_by, sort_order, page=result['page'] + 1, per_page=per_page,
+                            after=result['next_cursor'])
+
+@pytest.mark.parametrize('sort_by, key', [('name', lambda p: (p[1] or '', p[0])),
+                                          ('price', lambda p: (p[2] or 0, p[0]))])
+@pytest.mark.parametrize('sort_order', ['asc', 'desc'])
+def test_cursors_visit_every_listed_book_once(db_path, sort_by, key, sort_order):
+    expected = [p[0] for p in sorted(PRODUCTS, key=key, reverse=sort_order == 'desc')]
+
+    pages = walk(db_path, sort_by, sort_order)
+
+    assert [id for page in pages for id in page] == expected
+    assert len(pages) == list_books(db_path, sort_by, sort_order, per_page=2)['total_pages']
+
+def test_before_cursor_returns_the_previous_page(db_path):
+    pages = walk(db_path, 'price', 'asc')
+    second = list_books(db_path, 'price', 'asc', page=2, per_page=2,
+                        after=encode_cursor(0, pages[0][-1]))
+
+    previous = list_books(db_path, 'price', 'asc', page=1, per_page=2, before=second['prev_cursor'])
+
+    assert [row[0] for row in second['rows']] == pages[1]
+    assert [row[0] for row in previous['rows']] == pages[0]
+
+def test_cursor_on_a_missing_price_continues_after_it(db_path):
+    # Book 2 has no price, so its cursor key is the 0 it sorts as
+    key, product_id = decode_cursor(list_books(db_path, 'price', 'asc', per_page=1)['next_cursor'])
+    assert (key, product_id) == (0, 2)
+
+    result = list_books(db_path, 'price', 'asc', page=2, per_page=3, after=encode_cursor(key, product_id))
+
+    assert [row[0] for row in result['rows']] == [5, 6, 3]
@@ -0,0 +1,71 @@
+"""A default render compared with the output of the original pipeline.
+
+tests/data/baseline_cascade.png is what photo_cascade.py rendered before
+the tile cache, matching and reuse changes (the first commit of the
+repository) for make_library and make_reference below. The tiles are
+smooth gradients, so resampling them from the cached thumbnails instead of
+the full-size files hardly changes a pixel; a difference beyond that means
+a cell got another tile or was drawn elsewhere.
+"""
+import os
+import sqlite3
+import cv2
+import numpy as np
+import pytest
+from config import Config
+from photo_cascade import get_cell_edges, load_library, render_cascade
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'data', 'baseline_cascade.png')
+
+# (width, height) of the library images
+TILE_SHAPES = ((60, 80), (80, 60), (72, 72), (64, 96))
+
+def make_library(directory, n_tiles=48, seed=4):
+    """Write n_tiles gradient images and a database listing them; returns the database path"""
+    rng = np.random.default_rng(seed)
+    paths = []
+    for index in range(n_tiles):
+        w, h = TILE_SHAPES[rng.integers(len(TILE_SHAPES))]
+        start, end = rng.integers(0, 256, (2, 3))
+        ramp = np.linspace(0.0, 1.0, w)[None, :, None] if index % 2 else np.linspace(0.0, 1.0, h)[:, None, None]
+        tile = np.broadcast_to(start + (end - start) * ramp, (h, w, 3))
+        path = os.path.join(directory, f'tile_{index:03d}.png')
+        cv2.imwrite(path, np.round(tile).astype(np.uint8))
+        paths.append(path)
+    
+    db_path = os.path.join(directory, 'library.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE products (id INTEGER PRIMARY KEY, title TEXT, local_image_path TEXT)')
+    conn.execute('CREATE TABLE product_images (id INTEGER PRIMARY KEY, product_id INTEGER, local_path TEXT)')
+    conn.executemany('INSERT INTO products (title, local_image_path) VALUES (?, ?)',
+                     [(os.path.basename(path), path) for path in paths])
+    conn.commit()
+    conn.close()
+    return db_path
+
+def make_reference(width=360, height=240):
+    """A smooth reference image covering a wide range of colors"""
+    y, x = np.mgrid[0:height, 0:width] / np.array([height, width])[:, None, None]
+    blue = 255 * x
+    green = 255 * y
+    red = 127.5 + 127.5 * np.sin(2 * np.pi * (x + y))
+    return np.round(np.dstack([blue, green, red])).astype(np.uint8)
+
+def test_default_render_matches_baseline(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'TILE_CACHE_DIR', str(tmp_path / 'tiles'))
+    db_path = make_library(str(tmp_path))
+    library = load_library(db_path)
+    assert len(library['image_paths']) == 48  # no tile is a near-duplicate of another
+
+    output_img, stats = render_cascade(make_reference(), db_path, horizontal_grid_size=12, library=library)
+
+    baseline = cv2.imread(BASELINE)
+    assert output_img.shape == baseline.shape
+    diff = np.abs(output_img.astype(np.float64) - baseline)
+    rows, columns = stats['assignment'].shape
+    x_starts, x_ends = get_cell_edges(output_img.shape[1], columns)
+    y_starts, y_ends = get_cell_edges(output_img.shape[0], rows)
+    cell_diffs = np.array([[diff[y1:y2, x1:x2].mean() for x1, x2 in zip(x_starts, x_ends)]
+                           for y1, y2 in zip(y_starts, y_ends)])
+    assert diff.mean() < 1.0
+    assert cell_diffs.max() < 3.0
@@ -0,0 +1,170 @@
+"""download_all against a local ThreadingHTTPServer: retries, conditional
+requests and the per-host concurrency cap."""
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import cv2
+import numpy as np
+import pytest
+from download_images import download_all, setup_database
+
+IMAGE = cv2.imencode('.jpg', np.full((60, 40, 3), 128, np.uint8))[1].tobytes()
+ETAG = '"v1"'
+
+class ImageServer(ThreadingHTTPServer):
+    """Serves IMAGE (or bodies[path]) for every path; failures[path] 5xx answers come first"""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), ImageHandler)
+        self.lock = threading.Lock()
+        self.failures = {}
+        self.bodies = {}
+        self.delay = 0.0
+        self.requests = []  # (path, If-None-Match) of every request
+        self.active = 0
+        self.peak = 0
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+class ImageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_empty(self, status, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, self.headers.get('If-None-Match')))
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+            failing = server.failures.get(self.path, 0)
+            if failing:
+                server.failures[self.path] = failing - 1
+        try:
+            time.sleep(server.delay)
+            if failing:
+                self.send_empty(503)
+            elif self.headers.get('If-None-Match') == ETAG:
+                self.send_empty(304, [('ETag', ETAG)])
+            else:
+                body = server.bodies.get(self.path, IMAGE)
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('ETag', ETAG)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+@pytest.fixture
+def server():
+    server = ImageServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'images.db')
+    conn, _ = setup_database(path)
+    conn.executemany('INSERT INTO products (id, title) VALUES (?, ?)',
+                     [(product_id, f'Book {product_id}') for product_id in range(1, 13)])
+    conn.commit()
+    conn.close()
+    return path
+
+def make_tasks(server, tmp_path, count):
+    return [(f'{server.base_url}/covers/{product_id}.jpg', tmp_path / 'images' / f'{product_id}_featured.jpg',
+             product_id, 'featured')
+            for product_id in range(1, count + 1)]
+
+def run(tasks, db_path, **options):
+    options = {'workers': 4, 'per_host': 4, 'retries': 3, 'backoff': 0, 'timeout': 5, **options}
+    return download_all(tasks, db_path, **options)
+
+def test_server_errors_are_retried(server, db_path, tmp_path):
+    tasks = make_tasks(server, tmp_path, 3)
+    server.failures['/covers/1.jpg'] = 2
+
+    assert run(tasks, db_path) == {'skipped': 0, 'downloaded': 3}
+    assert [path for path, _ in server.requests].count('/covers/1.jpg') == 3
+    assert tasks[0][1].read_bytes() == IMAGE
+
+def test_persistent_server_errors_fail_without_partial_file(server, db_path, tmp_path):
+    tasks = make_tasks(server, tmp_path, 2)
+    server.failures['/covers/1.jpg'] = 10
+
+    assert run(tasks, db_path, retries=2) == {'skipped': 0, 'downloaded': 1, 'failed': 1}
+    assert [path for path, _ in server.requests].count('/covers/1.jpg') == 3
+    assert not tasks[0][1].exists()
+    assert not (tmp_path / 'images' / '1_featured.jpg.part').exists()
+
+    conn = sqlite3.connect(db_path)
+    statuses = dict(conn.execute('SELECT local_path, status FROM ingest_run_items'))
+    assert statuses == {str(tasks[0][1]): 'failed', str(tasks[1][1]): 'downloaded'}
+    assert conn.execute('SELECT local_image_path FROM products WHERE id = 1').fetchone() == (None,)
+
+def test_undecodable_response_is_discarded(server, db_path, tmp_path):
+    tasks = make_tasks(server, tmp_path, 2)
+    server.bodies['/covers/1.jpg'] = b'<html>Service unavailable</html>'
+
+    assert run(tasks, db_path, thumbnails_dir=str(tmp_path / 'thumbs')) == {'skipped': 0, 'downloaded': 1, 'failed': 1}
+    assert not tasks[0][1].exists()
+    assert not (tmp_path / 'images' / '1_featured.jpg.part').exists()
+    assert sorted(path.name for path in (tmp_path / 'thumbs').iterdir()) == [
+        '2_featured_200w.jpg', '2_featured_200w.webp', '2_featured_400w.jpg', '2_featured_400w.webp']
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT id FROM products WHERE local_image_path IS NOT NULL').fetchall() == [(2,)]
+    assert conn.execute('SELECT local_path FROM image_downloads').fetchall() == [(str(tasks[1][1]),)]
+    assert conn.execute('SELECT path FROM tile_features').fetchall() == [(str(tasks[1][1]),)]
+
+def test_revalidation_uses_stored_etag(server, db_path, tmp_path):
+    tasks = make_tasks(server, tmp_path, 3)
+    assert run(tasks, db_path) == {'skipped': 0, 'downloaded': 3}
+    mtimes = [task[1].stat().st_mtime_ns for task in tasks]
+
+    # Without revalidation valid local files are not requested again
+    server.requests.clear()
+    assert run(tasks, db_path) == {'skipped': 3}
+    assert server.requests == []
+
+    assert run(tasks, db_path, revalidate=True) == {'skipped': 0, 'not_modified': 3}
+    assert sorted(server.requests) == [(f'/covers/{i}.jpg', ETAG) for i in (1, 2, 3)]
+    assert [task[1].stat().st_mtime_ns for task in tasks] == mtimes
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT COUNT(*) FROM image_downloads WHERE etag = ?', (ETAG,)).fetchone() == (3,)
+    assert conn.execute('SELECT COUNT(*) FROM products WHERE local_image_path IS NOT NULL').fetchone() == (3,)
+
+def test_changed_url_is_downloaded_unconditionally(server, db_path, tmp_path):
+    tasks = make_tasks(server, tmp_path, 1)
+    run(tasks, db_path)
+    server.requests.clear()
+
+    moved = [(f'{server.base_url}/moved/1.jpg',) + tasks[0][1:]]
+    assert run(moved, db_path, revalidate=True) == {'skipped': 0, 'downloaded': 1}
+    assert server.requests == [('/moved/1.jpg', None)]
+
+def test_concurrency_is_capped_per_host(server, db_path, tmp_path):
+    tasks = make_tasks(server, tmp_path, 12)
+    server.delay = 0.05
+
+    assert run(tasks, db_path, workers=8, per_host=2) == {'skipped': 0, 'downloaded': 12}
+    assert server.peak == 2
@@ -0,0 +1,183 @@
+"""JobManager and the /api/jobs routes, with render_jpeg replaced by a
+render that waits until the test lets it finish."""
+import io
+import threading
+import time
+import pytest
+from app import create_app
+from app.jobs import manager as job_manager
+from config import Config
+
+class FakeRender:
+    """Stands in for render_jpeg; every call blocks on release"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.rendering = threading.Event()
+        self.calls = 0
+
+    def __call__(self, file_bytes, progress=None, **options):
+        self.calls += 1
+        progress('decode', 0.0)
+        progress('render', 0.5)
+        self.rendering.set()
+        if not self.release.wait(5):
+            raise TimeoutError('render was never released')
+        if file_bytes == b'broken':
+            raise ValueError('Could not decode image')
+        progress('encode', 1.0)
+        return b'jpeg:' + file_bytes, 'etag-' + file_bytes.decode(), 'MISS', {'tiles': 3}
+
+@pytest.fixture
+def render(monkeypatch):
+    fake = FakeRender()
+    monkeypatch.setattr(job_manager, 'render_jpeg', fake)
+    yield fake
+    fake.release.set()
+
+@pytest.fixture
+def app(tmp_path, render):
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "test.db"}'
+        RESULT_CACHE_DIR = str(tmp_path / 'results')
+        JOB_WORKERS = 1
+        JOB_QUEUE_DEPTH = 2
+
+    app = create_app(TestConfig)
+    yield app
+    render.release.set()
+    app.extensions['cascade_jobs'].shutdown()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+def submit(client, data=b'reference'):
+    return client.post('/api/jobs', data={'reference_image': (io.BytesIO(data), 'reference.png')})
+
+def wait_for(job, status, timeout=5):
+    deadline = time.time() + timeout
+    while job.status != status:
+        assert time.time() < deadline, f'job stayed {job.status}'
+        time.sleep(0.01)
+
+def test_manager_runs_job_and_reports_progress(render):
+    manager = job_manager.JobManager(workers=1, queue_depth=2)
+    try:
+        job = manager.submit(b'reference', horizontal_grid_size=40)
+        assert render.rendering.wait(5)
+        assert job.status == 'running'
+        assert job.stage == 'render'
+        assert 0 < job.progress < 1
+
+        render.release.set()
+        wait_for(job, 'done')
+        assert job.result == b'jpeg:reference'
+        assert job.etag == 'etag-reference'
+        assert set(job.timings) == {'decode', 'render', 'encode'}
+        assert manager.get(job.id) is job
+    finally:
+        manager.shutdown()
+
+def test_manager_rejects_jobs_past_queue_depth(render):
+    manager = job_manager.JobManager(workers=1, queue_depth=2)
+    try:
+        first = manager.submit(b'first')
+        manager.submit(b'second')
+        with pytest.raises(job_manager.QueueFullError):
+            manager.submit(b'third')
+
+        # Finished jobs stop counting against the depth
+        render.release.set()
+        wait_for(first, 'done')
+        while manager.pending():
+            time.sleep(0.01)
+        manager.submit(b'fourth')
+    finally:
+        render.release.set()
+        manager.shutdown()
+
+def test_manager_records_failure(render):
+    manager = job_manager.JobManager(workers=1, queue_depth=2)
+    try:
+        job = manager.submit(b'broken')
+        render.release.set()
+        wait_for(job, 'failed')
+        assert job.error == 'Could not decode image'
+        assert job.result is None
+    finally:
+        manager.shutdown()
+
+def test_manager_prunes_expired_jobs(render):
+    manager = job_manager.JobManager(workers=1, queue_depth=2, ttl=0)
+    try:
+        render.release.set()
+        job = manager.submit(b'reference')
+        wait_for(job, 'done')
+        time.sleep(0.01)
+        manager.prune()
+        assert manager.get(job.id) is None
+    finally:
+        manager.shutdown()
+
+def test_submit_returns_202_with_status_urls(client, render):
+    response = submit(client)
+    assert response.status_code == 202
+    body = response.get_json()
+    assert body['status'] in ('queued', 'running')
+    assert body['status_url'] == f"/api/jobs/{body['job_id']}"
+    assert response.headers['Location'] == body['status_url']
+
+def test_submit_without_image_is_rejected(client):
+    assert client.post('/api/jobs', data={}).status_code == 400
+
+def test_full_queue_returns_503_with_retry_after(client, render):
+    assert submit(client, b'first').status_code == 202
+    assert submit(client, b'second').status_code == 202
+    response = submit(client, b'third')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
+    assert 'full' in response.get_json()['error']
+
+def test_result_is_202_while_pending_then_served(client, render):
+    body = submit(client).get_json()
+    assert render.rendering.wait(5)
+
+    status = client.get(body['status_url']).get_json()
+    assert status['status'] == 'running'
+    assert status['stage'] == 'render'
+    assert 0 < status['progress'] < 1
+
+    pending = client.get(body['result_url'])
+    assert pending.status_code == 202
+    assert pending.headers['Retry-After'] == '1'
+
+    render.release.set()
+    job = client.application.extensions['cascade_jobs'].get(body['job_id'])
+    wait_for(job, 'done')
+    status = client.get(body['status_url']).get_json()
+    assert status['status'] == 'done'
+    assert status['progress'] == 1.0
+
+    result = client.get(body['result_url'])
+    assert result.status_code == 200
+    assert result.mimetype == 'image/jpeg'
+    assert result.data == b'jpeg:reference'
+    assert result.headers['X-Cache'] == 'MISS'
+
+    revalidated = client.get(body['result_url'], headers={'If-None-Match': '"etag-reference"'})
+    assert revalidated.status_code == 304
+
+def test_failed_job_result_is_500(client, render):
+    body = submit(client, b'broken').get_json()
+    render.release.set()
+    job = client.application.extensions['cascade_jobs'].get(body['job_id'])
+    wait_for(job, 'failed')
+    response = client.get(body['result_url'])
+    assert response.status_code == 500
+    assert response.get_json()['error'] == 'Could not decode image'
+
+def test_unknown_job_is_404(client):
+    assert client.get('/api/jobs/missing').status_code == 404
+    assert client.get('/api/jobs/missing/result').status_code == 404
@@ -0,0 +1,30 @@
+"""assign_tiles with the padded candidate lists approximate indexes return."""
+import numpy as np
+from tile_assigner import assign_tiles
+from tile_matcher import build_tile_index
+
+def test_padding_is_never_assigned():
+    # Cell 0 has one real candidate, cell 1 none until it asks for more
+    distances = np.array([[1.0, np.inf, np.inf], [np.inf, np.inf, np.inf]])
+    indices = np.array([[0, -1, -1], [-1, -1, -1]])
+    longer = {1: (np.array([2.0, 3.0, np.inf, np.inf, np.inf, np.inf]), np.array([0, 1, -1, -1, -1, -1]))}
+
+    assignment = assign_tiles(distances, indices, (1, 2), max_uses=1, query=lambda cell, k: longer[cell])
+
+    assert assignment.tolist() == [[0, 1]]
+
+def test_short_ivf_candidate_lists_yield_real_tiles():
+    rng = np.random.default_rng(0)
+    tiles = rng.integers(0, 256, (64, 3)).astype(np.float64)
+    cells = rng.integers(0, 256, (48, 3)).astype(np.float64)
+    index = build_tile_index(tiles, 'ivf', n_lists=16, n_probe=1)
+
+    def query(cell, k):
+        cell_distances, cell_indices = index.query(cells[cell:cell + 1], k)
+        return cell_distances[0], cell_indices[0]
+
+    distances, indices = index.query(cells, k=16)
+    assert (indices == -1).any()  # single-bucket probes run short of 16 tiles
+    assignment = assign_tiles(distances, indices, (6, 8), max_uses=1, query=query)
+
+    assert assignment.min() >= 0
@@ -0,0 +1,99 @@
+import hashlib
+import os
+import threading
+import cv2
+from pathlib import Path
+from config import Config
+
+# Widths the book covers are pre-sized to. The listing shows covers 300px
+# tall, roughly 200px wide, so 400px covers high-density screens.
+THUMBNAIL_WIDTHS = (200, 400)
+
+# Derivative formats: file extension, mimetype and encoder parameters
+THUMBNAIL_FORMATS = {
+    'webp': ('.webp', 'image/webp', [cv2.IMWRITE_WEBP_QUALITY, 80]),
+    'jpeg': ('.jpg', 'image/jpeg', [cv2.IMWRITE_JPEG_QUALITY, 80, cv2.IMWRITE_JPEG_PROGRESSIVE, 1]),
+}
+
+_etags = {}
+_etags_lock = threading.Lock()
+
+def source_version(src_path):
+    """Short token that changes whenever the source image is replaced.
+
+    Only stats the file, so it is cheap enough to put in every image URL;
+    a URL carrying the current version can then be cached forever.
+    """
+    stat = os.stat(src_path)
+    return hashlib.sha1(f"{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()[:12]
+
+def file_etag(path):
+    """Hash of the file contents, remembered until the file changes"""
+    stat = os.stat(path)
+    key = (str(path), stat.st_mtime_ns, stat.st_size)
+    with _etags_lock:
+        etag = _etags.get(key)
+    if etag is None:
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                digest.update(chunk)
+        etag = digest.hexdigest()
+        with _etags_lock:
+            _etags[key] = etag
+    return etag
+
+def derivative_path(src_path, width, fmt, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = Config.THUMBNAIL_DIR
+    extension = THUMBNAIL_FORMATS[fmt][0]
+    return Path(cache_dir) / f"{Path(src_path).stem}_{width}w{extension}"
+
+def write_derivative(img, width, fmt, path):
+    """Shrink img to width (never enlarging it) and encode it to path"""
+    h, w = img.shape[:2]
+    if w > width:
+        img = cv2.resize(img, (width, max(1, round(h * width / w))), interpolation=cv2.INTER_AREA)
+    extension, _, params = THUMBNAIL_FORMATS[fmt]
+    ok, data = cv2.imencode(extension, img, params)
+    if not ok:
+        raise ValueError(f"Could not encode {path}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(data.tobytes())
+    os.replace(tmp_path, path)
+
+def write_derivatives(img, src_path, cache_dir=None):
+    """Write every width and format of an already decoded image (at ingest)"""
+    for width in THUMBNAIL_WIDTHS:
+        for fmt in THUMBNAIL_FORMATS:
+            write_derivative(img, width, fmt, derivative_path(src_path, width, fmt, cache_dir))
+
+def get_derivative(src_path, width, fmt, cache_dir=None):
+    """Return the path of a thumbnail of src_path, creating it if missing.
+
+    A derivative older than its source is made again. Returns None if the
+    source cannot be decoded.
+    """
+    path = derivative_path(src_path, width, fmt, cache_dir)
+    try:
+        if path.stat().st_mtime_ns >= os.stat(src_path).st_mtime_ns:
+            return path
+    except FileNotFoundError:
+        pass
+    img = cv2.imread(str(src_path))
+    if img is None:
+        return None
+    write_derivative(img, width, fmt, path)
+    return path
+
+def preferred_format(accept_mimetypes):
+    """WebP for clients that list it explicitly, JPEG otherwise"""
+    return 'webp' if any(value == 'image/webp' and quality > 0 for value, quality in accept_mimetypes) else 'jpeg'
+
+def image_urls(filename, version):
+    """URL of an image under /public and {width: URL} of its thumbnails"""
+    query = f'?v={version}' if version else ''
+    return (f'/public/{filename}{query}',
+            {width: f'/thumbs/{width}/{filename}{query}' for width in THUMBNAIL_WIDTHS})
@@ -0,0 +1,88 @@
+import heapq
+import numpy as np
+
+def assign_tiles(distances, indices, grid_shape, max_uses=None, min_distance=0, query=None):
+    """Choose one tile per cell from k-nearest candidates under reuse limits.
+
+    distances and indices are the (cells, k) output of TileIndex.query for
+    the cells of a (rows, columns) grid in row-major order. A tile is used
+    at most max_uses times (None: unlimited), and never twice within
+    min_distance cells of itself (Chebyshev distance, so 1 forbids the 8
+    neighbours).
+
+    Cells are settled greedily, best match first: a priority queue holds
+    every unsettled cell's best remaining candidate, and a cell whose
+    candidate is taken moves on to its next one, at O(log(cells)) per
+    candidate passed over.
+
+    A cell that runs out of candidates asks query(cell, k) for a longer
+    list, doubling k each time, when query is given. Once no more tiles
+    are available it takes its nearest candidate that keeps the distance
+    rule, ignoring the usage cap, or failing that its nearest candidate.
+    Candidates with index -1 or an infinite distance, which approximate
+    indexes return when they find fewer than k tiles, are skipped.
+
+    Returns the (rows, columns) array of tile indices.
+    """
+    rows, columns = grid_shape
+    n_cells = len(indices)
+    if n_cells != rows * columns:
+        raise ValueError(f"{n_cells} candidate lists for a {rows}x{columns} grid")
+
+    assignment = np.full(grid_shape, -1, dtype=np.int64)
+    uses = {}
+    lists = {}  # cell -> (distances, indices, k asked for), without the padding
+
+    def usable(cell_distances, cell_indices, k):
+        valid = (cell_indices >= 0) & np.isfinite(cell_distances)
+        return cell_distances[valid], cell_indices[valid], k
+
+    def candidates(cell):
+        if cell not in lists:
+            lists[cell] = usable(distances[cell], indices[cell], indices.shape[1])
+        return lists[cell]
+
+    def repeats_nearby(tile, row, column):
+        window = assignment[max(0, row - min_distance):row + min_distance + 1,
+                            max(0, column - min_distance):column + min_distance + 1]
+        return bool((window == tile).any())
+
+    heap = []
+    for cell in range(n_cells):
+        cell_distances = candidates(cell)[0]
+        heap.append((cell_distances[0] if len(cell_distances) else np.inf, cell, 0))
+    heapq.heapify(heap)
+    exhausted = []
+    while heap:
+        _, cell, rank = heapq.heappop(heap)
+        row, column = divmod(cell, columns)
+        cell_distances, cell_indices, k = candidates(cell)
+        if rank < len(cell_indices):
+            tile = int(cell_indices[rank])
+            full = max_uses is not None and uses.get(tile, 0) >= max_uses
+            if not full and not (min_distance and repeats_nearby(tile, row, column)):
+                assignment[row, column] = tile
+                uses[tile] = uses.get(tile, 0) + 1
+                continue
+            rank += 1
+        if rank == len(cell_indices) and query is not None:
+            longer = usable(*query(cell, 2 * k), 2 * k)
+            if len(longer[1]) > len(cell_indices):
+                lists[cell] = cell_distances, cell_indices, _ = longer
+        if rank < len(cell_indices):
+            heapq.heappush(heap, (cell_distances[rank], cell, rank))
+        else:
+            exhausted.append(cell)
+
+    for cell in exhausted:
+        row, column = divmod(cell, columns)
+        cell_indices = candidates(cell)[1]
+        if len(cell_indices) == 0:
+            raise ValueError(f"No candidate tiles for cell {cell}")
+        allowed = [tile for tile in cell_indices.tolist()
+                   if not (min_distance and repeats_nearby(tile, row, column))]
+        tile = allowed[0] if allowed else int(cell_indices[0])
+        assignment[row, column] = tile
+        uses[tile] = uses.get(tile, 0) + 1
+
+    return assignment
@@ -0,0 +1,216 @@
+import os
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+def fit_tile(img, target_size, original_size=None, interpolation=None):
+    """Resize img to fit target_size keeping its aspect ratio.
+
+    original_size is the (width, height) the fit is computed from; it
+    defaults to img's own size and lets an already shrunk copy produce the
+    same tile dimensions as the full image. interpolation defaults to
+    INTER_AREA when shrinking, which averages every source pixel instead of
+    aliasing like INTER_LINEAR, and INTER_LINEAR when enlarging. Returns
+    the resized image and the padding that centres it in the target.
+    """
+    target_w, target_h = target_size
+    if original_size is None:
+        original_size = (img.shape[1], img.shape[0])
+    w, h = original_size
+    
+    # Calculate scaling to fit within target size while maintaining aspect ratio
+    scale = min(target_w/w, target_h/h)
+    new_w = max(1, int(w * scale))
+    new_h = max(1, int(h * scale))
+    
+    if interpolation is None:
+        shrinking = new_w < img.shape[1] or new_h < img.shape[0]
+        interpolation = cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR
+    resized = cv2.resize(img, (new_w, new_h), interpolation=interpolation)
+    
+    # Calculate padding to center the image
+    pad_x = (target_w - new_w) // 2
+    pad_y = (target_h - new_h) // 2
+    return resized, pad_x, pad_y
+
+def letterbox_tile(img, target_size):
+    """Fit img into a black uint8 tile of target_size, centred"""
+    target_w, target_h = target_size
+    resized, pad_x, pad_y = fit_tile(img, target_size)
+    new_h, new_w = resized.shape[:2]
+    tile = np.zeros((target_h, target_w, 3), dtype=np.uint8)
+    tile[pad_y:pad_y+new_h, pad_x:pad_x+new_w] = resized
+    return tile
+
+def build_tile_atlas(image_paths, target_size, atlas_path=None, thumbnails=None):
+    """Decode image_paths and pack them into a TileAtlas padded to target_size
+
+    thumbnails maps a path to (image, (width, height)) with the image
+    already fitted to target_size (see tile_features.load_thumbnails);
+    those paths are not decoded again.
+    """
+    if thumbnails is None:
+        thumbnails = {}
+    target_w, target_h = target_size
+    if atlas_path is not None:
+        tiles = TileAtlas.allocate(atlas_path, len(image_paths), target_size)
+    else:
+        tiles = np.zeros((len(image_paths), target_h, target_w, 3), dtype=np.uint8)
+    mean_colors = np.zeros((len(image_paths), 3), dtype=np.float64)
+    original_sizes = np.zeros((len(image_paths), 2), dtype=np.int32)
+    resized_sizes = np.zeros((len(image_paths), 2), dtype=np.int32)
+    path_index = np.zeros(len(image_paths), dtype=np.int32)
+    count = 0
+    
+    for index, img_path in enumerate(tqdm(image_paths)):
+        try:
+            if img_path in thumbnails:
+                img, (w, h) = thumbnails[img_path]
+            else:
+                img = cv2.imread(img_path)
+                if img is None:
+                    continue
+                h, w = img.shape[:2]
+            
+            resized, pad_x, pad_y = fit_tile(img, target_size, (w, h))
+            new_h, new_w = resized.shape[:2]
+            
+            # Write the centred tile into its slot of the atlas
+            tiles[count, pad_y:pad_y+new_h, pad_x:pad_x+new_w] = resized
+            
+            # Calculate average color of the resized image
+            mean_colors[count] = np.mean(resized, axis=(0, 1))
+            original_sizes[count] = (w, h)
+            resized_sizes[count] = (new_w, new_h)
+            path_index[count] = index
+            count += 1
+        except Exception as e:
+            print(f"Error processing image {img_path}: {e}")
+            continue
+    
+    atlas = TileAtlas(tiles[:count], mean_colors[:count], original_sizes[:count],
+                      resized_sizes[:count], path_index[:count], image_paths)
+    if atlas_path is not None:
+        tiles.flush()
+        atlas.save(atlas_path)
+    return atlas
+
+class TileAtlas:
+    """All tiles of one cell size packed into a single contiguous array.
+
+    tiles is a uint8 array of shape (M, h, w, 3) holding every tile padded
+    to the cell size. The parallel arrays describe tile k:
+      mean_colors[k]     mean BGR color of the resized (unpadded) tile
+      original_sizes[k]  (width, height) of the source image
+      resized_sizes[k]   (width, height) of the tile before padding
+      path_index[k]      index into paths of the source image
+    """
+
+    def __init__(self, tiles, mean_colors, original_sizes, resized_sizes, path_index, paths):
+        self.tiles = tiles
+        self.mean_colors = mean_colors
+        self.original_sizes = original_sizes
+        self.resized_sizes = resized_sizes
+        self.path_index = path_index
+        self.paths = list(paths)
+        # Match indexes built over the tiles, see photo_cascade.get_tile_index
+        self.indexes = {}
+
+    def __len__(self):
+        return len(self.tiles)
+
+    @property
+    def tile_size(self):
+        """Cell size the tiles were padded to, as (width, height)"""
+        return self.tiles.shape[2], self.tiles.shape[1]
+
+    def tile_content(self, k):
+        """Tile k without its padding"""
+        target_w, target_h = self.tile_size
+        new_w, new_h = self.resized_sizes[k]
+        pad_x = (target_w - new_w) // 2
+        pad_y = (target_h - new_h) // 2
+        return self.tiles[k, pad_y:pad_y+new_h, pad_x:pad_x+new_w]
+
+    def resized(self, target_size, tiles_path=None):
+        """Return a new atlas with every tile refitted to target_size.
+
+        Meant for shrinking a larger cached level: each tile is fitted from
+        its unpadded content with the same size rule as build_tile_atlas.
+        The new tiles are held in memory, or written to a memory-mapped
+        .npy at tiles_path and saved there like build_tile_atlas does.
+        """
+        target_w, target_h = target_size
+        if tiles_path is not None:
+            tiles = TileAtlas.allocate(tiles_path, len(self), target_size)
+        else:
+            tiles = np.zeros((len(self), target_h, target_w, 3), dtype=np.uint8)
+        mean_colors = np.zeros((len(self), 3), dtype=np.float64)
+        resized_sizes = np.zeros((len(self), 2), dtype=np.int32)
+
+        for k in range(len(self)):
+            w, h = self.original_sizes[k]
+            resized, pad_x, pad_y = fit_tile(self.tile_content(k), target_size, (w, h))
+            new_h, new_w = resized.shape[:2]
+            tiles[k, pad_y:pad_y+new_h, pad_x:pad_x+new_w] = resized
+            mean_colors[k] = np.mean(resized, axis=(0, 1))
+            resized_sizes[k] = (new_w, new_h)
+
+        atlas = TileAtlas(tiles, mean_colors, self.original_sizes.copy(), resized_sizes,
+                          self.path_index.copy(), self.paths)
+        if tiles_path is not None:
+            tiles.flush()
+            atlas.save(tiles_path)
+        return atlas
+
+    def region_colors(self, regions):
+        """Mean BGR color of a regions x regions grid over every tile.
+
+        The grid covers the padded tile, as it is drawn into a cell.
+        Returns a float64 array of shape (M, regions, regions, 3).
+        """
+        colors = np.zeros((len(self), regions, regions, 3), dtype=np.float64)
+        for k in range(len(self)):
+            colors[k] = cv2.resize(self.tiles[k].astype(np.float32), (regions, regions),
+                                   interpolation=cv2.INTER_AREA)
+        return colors
+
+    def tile_path(self, k):
+        """Source image path of tile k"""
+        return self.paths[self.path_index[k]]
+
+    @staticmethod
+    def meta_path(tiles_path):
+        return os.path.splitext(tiles_path)[0] + '.meta.npz'
+
+    @staticmethod
+    def allocate(tiles_path, count, tile_size):
+        """Create a zeroed .npy tile array on disk, memory-mapped for writing"""
+        target_w, target_h = tile_size
+        return np.lib.format.open_memmap(tiles_path, mode='w+', dtype=np.uint8,
+                                         shape=(count, target_h, target_w, 3))
+
+    def save(self, tiles_path):
+        """Write the tiles to tiles_path (.npy) and the parallel arrays next to it"""
+        if not (isinstance(self.tiles, np.memmap) and self.tiles.filename == os.path.abspath(tiles_path)):
+            np.save(tiles_path, np.ascontiguousarray(self.tiles))
+        np.savez(self.meta_path(tiles_path),
+                 count=len(self),
+                 mean_colors=self.mean_colors,
+                 original_sizes=self.original_sizes,
+                 resized_sizes=self.resized_sizes,
+                 path_index=self.path_index,
+                 paths=np.array(self.paths, dtype=str))
+
+    @classmethod
+    def load(cls, tiles_path, mmap=True):
+        """Load an atlas written by save(); tiles are memory-mapped unless mmap=False"""
+        with np.load(cls.meta_path(tiles_path)) as meta:
+            count = int(meta['count'])
+            tiles = np.load(tiles_path, mmap_mode='r' if mmap else None)[:count]
+            return cls(tiles,
+                       meta['mean_colors'],
+                       meta['original_sizes'],
+                       meta['resized_sizes'],
+                       meta['path_index'],
+                       meta['paths'].tolist())
@@ -0,0 +1,155 @@
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from config import Config
+from tile_atlas import TileAtlas, build_tile_atlas
+from tile_features import THUMBNAIL_SIZE, load_tile_features, load_thumbnails, library_version
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Square box sizes the library is pre-rendered at. A request for cell size
+# (w, h) is served from the smallest level with max(w, h) <= level. The
+# smallest level is built from the thumbnails stored with the features.
+PYRAMID_LEVELS = (THUMBNAIL_SIZE, 64, 128, 256)
+
+_build_lock = threading.Lock()
+
+@contextmanager
+def cache_lock(cache_dir):
+    """Hold the cache directory's lock, shared with every other process using it.
+
+    Builds and evictions happen under it, so no process sees a level that
+    is half written or loads one another process is deleting.
+    """
+    with _build_lock, open(Path(cache_dir) / '.lock', 'a+b') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue  # LK_LOCK gives up after 10 seconds
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+def pyramid_level_for(target_size, levels=PYRAMID_LEVELS):
+    """Return the smallest level that can be shrunk to target_size, or None"""
+    needed = max(target_size)
+    for level in levels:
+        if level >= needed:
+            return level
+    return None
+
+def _atlas_path(cache_dir, tile_size, version):
+    width, height = tile_size
+    return Path(cache_dir) / f"tiles_{width}x{height}_{version[:16]}.npy"
+
+def _write_atlas(atlas_path, build):
+    """Write an atlas with build(tmp_path), then move it into place"""
+    tmp_path = atlas_path.with_name(f"{atlas_path.stem}.tmp{os.getpid()}.npy")
+    build(str(tmp_path))
+    os.replace(TileAtlas.meta_path(str(tmp_path)), TileAtlas.meta_path(str(atlas_path)))
+    os.replace(tmp_path, atlas_path)
+
+def _cache_entries(cache_dir):
+    """Group cache files by level stem: {stem: [paths]}"""
+    entries = {}
+    for path in Path(cache_dir).glob('tiles_*'):
+        stem = path.name.split('.')[0]
+        entries.setdefault(stem, []).append(path)
+    return entries
+
+def evict_tile_cache(cache_dir, max_bytes, version=None, keep=None):
+    """Drop stale levels, then least recently used ones until under max_bytes.
+
+    Levels built for a different library version are always removed. keep
+    is the .npy path of a level that must survive (the one just used).
+    """
+    entries = _cache_entries(cache_dir)
+    keep_stem = Path(keep).name.split('.')[0] if keep is not None else None
+    live = []
+    for stem, paths in entries.items():
+        if version is not None and not stem.endswith(version[:16]) and stem != keep_stem:
+            for path in paths:
+                path.unlink(missing_ok=True)
+            continue
+        size = sum(path.stat().st_size for path in paths)
+        last_used = max(path.stat().st_mtime for path in paths)
+        live.append((last_used, stem, size, paths))
+
+    total = sum(size for _, _, size, _ in live)
+    for _, stem, size, paths in sorted(live):
+        if total <= max_bytes:
+            break
+        if stem == keep_stem:
+            continue
+        for path in paths:
+            path.unlink(missing_ok=True)
+        total -= size
+
+def load_pyramid_level(image_paths, level, version, cache_dir, max_bytes, db_path=None, target_size=None):
+    """Load one cached level, building it from the full-size images if needed
+
+    With target_size the level is shrunk to that cell size, and the result
+    is cached next to the levels so later requests memory-map it as well.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    level_path = _atlas_path(cache_dir, (level, level), version)
+    atlas_path = _atlas_path(cache_dir, target_size or (level, level), version)
+
+    with cache_lock(cache_dir):
+        if not atlas_path.exists():
+            if not level_path.exists():
+                print(f"Building {level}px tile cache level...")
+                thumbnails = load_thumbnails(image_paths, db_path) if level == THUMBNAIL_SIZE else None
+                _write_atlas(level_path, lambda tmp_path: build_tile_atlas(image_paths, (level, level),
+                                                                            tmp_path, thumbnails))
+            if atlas_path != level_path:
+                level_atlas = TileAtlas.load(str(level_path))
+                _write_atlas(atlas_path, lambda tmp_path: level_atlas.resized(target_size, tmp_path))
+        else:
+            # Mark the atlas as recently used for eviction
+            os.utime(atlas_path)
+        evict_tile_cache(cache_dir, max_bytes, version, keep=atlas_path)
+        return TileAtlas.load(str(atlas_path))
+
+def load_tile_atlas(image_paths, target_size, db_path=None, cache_dir=None, max_bytes=None, features=None):
+    """Return a TileAtlas for target_size, served from the on-disk pyramid.
+
+    The library is pre-rendered once per pyramid level as a memory-mapped
+    atlas, and each cell size is shrunk from the nearest larger level once
+    and cached the same way. Atlases are keyed by the library version, so
+    changes under IMAGES_DIR invalidate them. Cells larger than the biggest
+    level fall back to decoding the full-size images. features are the
+    load_tile_features dicts of image_paths, if the caller already has
+    them.
+    """
+    if cache_dir is None:
+        cache_dir = Config.TILE_CACHE_DIR
+    if max_bytes is None:
+        max_bytes = Config.TILE_CACHE_MAX_BYTES
+
+    if features is None:
+        features = load_tile_features(image_paths, db_path)
+    valid_paths = [feature['path'] for feature in features]
+
+    level = pyramid_level_for(target_size)
+    if level is None:
+        return build_tile_atlas(valid_paths, target_size)
+
+    return load_pyramid_level(valid_paths, level, library_version(features), cache_dir, max_bytes, db_path,
+                              target_size)
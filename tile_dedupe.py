@@ -0,0 +1,225 @@
+import argparse
+import math
+import threading
+import numpy as np
+from config import Config
+from tile_features import load_tile_features, library_version
+from tile_matcher import bgr_to_lab
+
+# Set bits of every byte value, to count the bits of XORed hashes on numpy < 2
+_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+# Hash pairs compared at once; bounds the temporary arrays of
+# hamming_distances however large a bucket gets
+_BLOCK_ELEMENTS = 4 * 1024 * 1024
+
+# Buckets with more images than this (e.g. many flat covers, whose hashes
+# are all alike) are only compared within coarse color cells
+_MAX_BUCKET = 2048
+
+_last_result = None
+_last_result_lock = threading.Lock()
+
+def hamming_distances(block, hashes):
+    """len(block) x len(hashes) matrix of bit differences between uint64 hashes"""
+    xor = block[:, None] ^ hashes[None, :]
+    if hasattr(np, 'bitwise_count'):  # numpy >= 2.0
+        return np.bitwise_count(xor)
+    return _POPCOUNT[xor.view(np.uint8)].reshape(xor.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+class UnionFind:
+    """Disjoint sets of the items 0..size-1.
+
+    Given colors, two sets are only merged while the bounding box of all
+    their colors has a diagonal of at most max_spread, so no two members
+    of a set ever differ by more than max_spread; merges cannot chain
+    from one color to another.
+    """
+
+    def __init__(self, size, colors=None, max_spread=None):
+        self.parent = list(range(size))
+        self.max_spread = max_spread
+        self.low = self.high = None
+        if colors is not None:
+            self.low = [tuple(color) for color in np.asarray(colors, dtype=float).tolist()]
+            self.high = list(self.low)
+
+    def find(self, item):
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return
+        root, child = min(root_a, root_b), max(root_a, root_b)
+        if self.low is not None:
+            low = tuple(map(min, self.low[root], self.low[child]))
+            high = tuple(map(max, self.high[root], self.high[child]))
+            if math.dist(low, high) > self.max_spread:
+                return
+            self.low[root], self.high[root] = low, high
+        self.parent[child] = root
+
+def _groups(keys):
+    """Index arrays of the items sharing each distinct key (row of keys)"""
+    _, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    order = np.argsort(inverse, kind='stable')
+    return np.split(order, np.flatnonzero(np.diff(inverse[order])) + 1)
+
+def cluster_hashes(hashes, max_distance, colors=None, max_color_distance=None):
+    """Group 64-bit hashes that are within max_distance bits of each other.
+
+    The hashes are split into max_distance + 1 bands; two hashes that
+    differ in at most max_distance bits agree exactly on at least one
+    band. So only hashes sharing a band value are compared, instead of
+    every pair. Clusters are the connected components of those matches.
+
+    colors, an (N, 3) Lab array, keeps images of different colors apart:
+    a pair must also be within max_color_distance, and a cluster never
+    spans more than that (see UnionFind). Returns one cluster label per
+    hash.
+    """
+    hashes = np.asarray(hashes, dtype=np.int64).view(np.uint64)
+    if len(hashes) == 0:
+        return []
+    if colors is None:
+        clusters = UnionFind(len(hashes))
+        fine = coarse = np.zeros((len(hashes), 3), dtype=np.int64)
+    else:
+        colors = np.asarray(colors, dtype=np.float64)
+        clusters = UnionFind(len(hashes), colors, max_color_distance)
+        # Any two colors in one fine cell are within max_color_distance
+        fine = np.floor(colors * np.sqrt(3) / max_color_distance).astype(np.int64)
+        coarse = np.floor(colors / max_color_distance).astype(np.int64)
+
+    # Identical hashes in one fine color cell are merged without comparing
+    # bits, and only the first of them takes part in the band search
+    keys = np.column_stack([hashes.view(np.int64), fine])
+    _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    for item in np.flatnonzero(first[inverse] != np.arange(len(hashes))):
+        clusters.union(first[inverse[item]], item)
+    representatives = np.sort(first)
+
+    edges = np.linspace(0, 64, max_distance + 2).astype(int)
+    compared = set()
+    for start, stop in zip(edges[:-1], edges[1:]):
+        mask = np.uint64((1 << (stop - start)) - 1)
+        band = (hashes[representatives] >> np.uint64(start)) & mask
+        for bucket in _groups(band):
+            # Near-identical hashes share every band; compare them only once
+            bucket = representatives[bucket]
+            if len(bucket) < 2 or bucket.tobytes() in compared:
+                continue
+            compared.add(bucket.tobytes())
+            if len(bucket) > _MAX_BUCKET:
+                parts = [bucket[part] for part in _groups(coarse[bucket])]
+            else:
+                parts = [bucket]
+            for part in parts:
+                _union_close_pairs(clusters, part, hashes, max_distance, colors, max_color_distance)
+
+    return [clusters.find(item) for item in range(len(hashes))]
+
+def _union_close_pairs(clusters, items, hashes, max_distance, colors, max_color_distance):
+    """Merge every pair of items within max_distance bits (and colors)"""
+    if len(items) < 2:
+        return
+    item_hashes = hashes[items]
+    block_rows = max(1, _BLOCK_ELEMENTS // len(items))
+    for offset in range(0, len(items), block_rows):
+        distances = hamming_distances(item_hashes[offset:offset + block_rows], item_hashes)
+        rows, columns = np.nonzero(distances <= max_distance)
+        rows += offset
+        keep = columns > rows
+        a, b = items[rows[keep]], items[columns[keep]]
+        if colors is not None:
+            close = np.linalg.norm(colors[a] - colors[b], axis=1) <= max_color_distance
+            a, b = a[close], b[close]
+        for item_a, item_b in zip(a.tolist(), b.tolist()):
+            clusters.union(item_a, item_b)
+
+def dedupe_features(features, max_distance, preferred=(), max_color_distance=None):
+    """Keep one representative of every cluster of near-identical tiles.
+
+    Duplicates have hashes within max_distance bits and mean colors
+    within max_color_distance (CIE Lab, default
+    Config.DEDUPE_MAX_COLOR_DISTANCE); the hash alone ignores color, so
+    flat covers of any color would look alike. preferred paths (the
+    featured covers) are kept over the other members of their cluster,
+    then the largest image. Returns the kept features in their original
+    order and {kept path: [dropped paths]}.
+    """
+    if max_color_distance is None:
+        max_color_distance = Config.DEDUPE_MAX_COLOR_DISTANCE
+    colors = bgr_to_lab([feature['avg_color'] for feature in features]) if features else None
+    labels = cluster_hashes([feature['phash'] for feature in features], max_distance, colors, max_color_distance)
+    preferred = set(preferred)
+
+    members = {}
+    for label, feature in zip(labels, features):
+        members.setdefault(label, []).append(feature)
+
+    kept = set()
+    duplicates = {}
+    for cluster in members.values():
+        best = max(cluster, key=lambda f: (f['path'] in preferred, f['width'] * f['height']))
+        kept.add(best['path'])
+        if len(cluster) > 1:
+            duplicates[best['path']] = [f['path'] for f in cluster if f is not best]
+
+    return [feature for feature in features if feature['path'] in kept], duplicates
+
+def dedupe_image_paths(image_paths, db_path=None, max_distance=None, preferred=(), features=None):
+    """image_paths without near-duplicates, see dedupe_features.
+
+    features are the load_tile_features dicts of image_paths, if the
+    caller already has them. The result is remembered until the library
+    or the arguments change, so repeated renders only pay for the feature
+    lookup.
+    """
+    global _last_result
+    if max_distance is None:
+        max_distance = Config.DEDUPE_MAX_DISTANCE
+    if max_distance < 0:
+        return image_paths
+
+    if features is None:
+        features = load_tile_features(image_paths, db_path)
+    key = (library_version(features), max_distance, Config.DEDUPE_MAX_COLOR_DISTANCE, hash(frozenset(preferred)))
+    with _last_result_lock:
+        if _last_result is not None and _last_result[0] == key:
+            return list(_last_result[1])
+
+    kept, _ = dedupe_features(features, max_distance, preferred)
+    result = [feature['path'] for feature in kept]
+    with _last_result_lock:
+        _last_result = (key, result)
+    return list(result)
+
+def main():
+    from photo_cascade import get_featured_images, get_product_images
+
+    parser = argparse.ArgumentParser(description='Report near-duplicate images in the tile library')
+    parser.add_argument('--db', default=Config.DATABASE_PATH)
+    parser.add_argument('--max-distance', type=int, default=Config.DEDUPE_MAX_DISTANCE,
+                        help='largest number of differing hash bits between duplicates')
+    parser.add_argument('--max-color-distance', type=float, default=Config.DEDUPE_MAX_COLOR_DISTANCE,
+                        help='largest CIE Lab distance between the mean colors of duplicates')
+    args = parser.parse_args()
+
+    features = load_tile_features(get_product_images(args.db, dedupe=False), args.db)
+    kept, duplicates = dedupe_features(features, args.max_distance, get_featured_images(args.db),
+                                       args.max_color_distance)
+    for path, dropped in sorted(duplicates.items()):
+        print(f"{path}: {', '.join(dropped)}")
+    print(f"{len(features)} images, {len(kept)} kept, {len(features) - len(kept)} near-duplicates dropped")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+import hashlib
+import os
+import sqlite3
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from tqdm import tqdm
+from config import Config
+from tile_atlas import fit_tile
+
+# Per-tile metadata is stored next to the catalog in mph_images.db so that a
+# request only has to stat() the library instead of decoding every JPEG.
+FEATURE_COLUMNS = ('path', 'width', 'height', 'aspect_ratio',
+                   'mean_b', 'mean_g', 'mean_r', 'file_mtime', 'file_size', 'phash')
+
+# Every image also gets a lossless thumbnail fitted into this square, the
+# smallest tile cache level, so that level never decodes full-size files.
+THUMBNAIL_SIZE = 32
+
+def setup_feature_table(conn):
+    """Create the tile_features table if it does not exist yet"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS tile_features (
+        path TEXT PRIMARY KEY,
+        width INTEGER,  -- 0 marks a file that could not be decoded
+        height INTEGER,
+        aspect_ratio REAL,
+        mean_b REAL,
+        mean_g REAL,
+        mean_r REAL,
+        file_mtime REAL,
+        file_size INTEGER,
+        phash INTEGER,  -- 64-bit perceptual hash, see perceptual_hash
+        thumbnail BLOB,  -- PNG fitted into THUMBNAIL_SIZE, see make_thumbnail
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    
+    # Tables created before thumbnails and hashes were stored
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(tile_features)')]
+    if 'thumbnail' not in columns:
+        conn.execute('ALTER TABLE tile_features ADD COLUMN thumbnail BLOB')
+    if 'phash' not in columns:
+        conn.execute('ALTER TABLE tile_features ADD COLUMN phash INTEGER')
+    conn.commit()
+
+def resolve_image_path(path, images_dir=None):
+    """Map a path stored in the database to a file on this machine.
+
+    Rows written on Windows use backslashes and the old 'images' directory,
+    so fall back to the file of the same name inside IMAGES_DIR.
+    """
+    if images_dir is None:
+        images_dir = Config.IMAGES_DIR
+
+    normalized = path.replace('\\', '/')
+    if os.path.exists(normalized):
+        return normalized
+
+    candidate = Path(images_dir) / os.path.basename(normalized)
+    if candidate.exists():
+        return str(candidate)
+    return normalized
+
+def make_thumbnail(img):
+    """PNG bytes of img fitted into THUMBNAIL_SIZE exactly as the tile cache fits it"""
+    thumbnail, _, _ = fit_tile(img, (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+    return cv2.imencode('.png', thumbnail)[1].tobytes()
+
+def perceptual_hash(img):
+    """64-bit DCT hash of img, as a signed integer so SQLite can store it.
+
+    Bits are set where the 8x8 lowest frequencies of the 32x32 grayscale
+    image exceed their median, so recompressed or slightly cropped copies
+    of an image differ in only a few bits.
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])  # the DC term would skew the median
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big', signed=True)
+
+def compute_tile_features(img_path, img=None):
+    """Decode an image once and return its feature row followed by its thumbnail.
+
+    img is the already decoded image, e.g. when called while downloading.
+    """
+    stat = os.stat(img_path)
+    if img is None:
+        img = cv2.imread(img_path)
+    if img is None:
+        return (img_path, 0, 0, 0.0, 0.0, 0.0, 0.0, stat.st_mtime, stat.st_size, None, None)
+
+    h, w = img.shape[:2]
+    mean_b, mean_g, mean_r = np.mean(img, axis=(0, 1))
+    return (img_path, w, h, w / h, float(mean_b), float(mean_g), float(mean_r),
+            stat.st_mtime, stat.st_size, perceptual_hash(img), make_thumbnail(img))
+
+# compute_tile_features rows are stored with this statement
+STORE_FEATURES = f'''
+INSERT OR REPLACE INTO tile_features ({', '.join(FEATURE_COLUMNS + ('thumbnail',))})
+VALUES ({', '.join('?' * (len(FEATURE_COLUMNS) + 1))})
+'''
+
+def load_tile_features(image_paths, db_path=None):
+    """Return feature dicts for image_paths, recomputing only stale entries.
+
+    An entry is reused when the file's mtime and size still match what was
+    stored (and it has a hash, which rows from before hashing lack). Files
+    that are missing or cannot be decoded are left out.
+    """
+    if db_path is None:
+        db_path = Config.DATABASE_PATH
+
+    conn = sqlite3.connect(db_path)
+    setup_feature_table(conn)
+
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {', '.join(FEATURE_COLUMNS)} FROM tile_features")
+    stored = {row[0]: row for row in cursor.fetchall()}
+
+    rows = {}
+    stale_paths = []
+    for img_path in image_paths:
+        try:
+            stat = os.stat(img_path)
+        except OSError:
+            continue
+
+        row = stored.get(img_path)
+        if (row is not None and row[7] == stat.st_mtime and row[8] == stat.st_size
+                and (row[1] == 0 or row[9] is not None)):
+            rows[img_path] = row
+        else:
+            stale_paths.append(img_path)
+
+    if stale_paths:
+        print(f"Computing tile features for {len(stale_paths)} images...")
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            computed = list(tqdm(executor.map(compute_tile_features, stale_paths),
+                                 total=len(stale_paths)))
+
+        cursor.executemany(STORE_FEATURES, computed)
+        conn.commit()
+        rows.update((row[0], row[:len(FEATURE_COLUMNS)]) for row in computed)
+
+    conn.close()
+
+    features = []
+    for img_path in image_paths:
+        row = rows.get(img_path)
+        if row is None or row[1] == 0:
+            continue
+        features.append({
+            'path': row[0],
+            'width': row[1],
+            'height': row[2],
+            'aspect_ratio': row[3],
+            'avg_color': np.array(row[4:7]),
+            'file_mtime': row[7],
+            'file_size': row[8],
+            'phash': row[9]
+        })
+    return features
+
+def load_thumbnails(image_paths, db_path=None):
+    """Return {path: (thumbnail, (width, height))} for the paths that have one.
+
+    Thumbnails are decoded from tile_features; the size is that of the
+    full image. Rows are only trusted while the file's mtime and size
+    still match.
+    """
+    if db_path is None:
+        db_path = Config.DATABASE_PATH
+
+    wanted = set(image_paths)
+    conn = sqlite3.connect(db_path)
+    setup_feature_table(conn)
+    cursor = conn.execute('''
+    SELECT path, width, height, file_mtime, file_size, thumbnail FROM tile_features
+    WHERE thumbnail IS NOT NULL
+    ''')
+
+    thumbnails = {}
+    for path, width, height, file_mtime, file_size, thumbnail in cursor:
+        if path not in wanted:
+            continue
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if stat.st_mtime != file_mtime or stat.st_size != file_size:
+            continue
+        img = cv2.imdecode(np.frombuffer(thumbnail, np.uint8), cv2.IMREAD_COLOR)
+        if img is not None:
+            thumbnails[path] = (img, (width, height))
+    conn.close()
+    return thumbnails
+
+def library_version(features):
+    """Return a stamp that changes whenever a tile is added, removed or modified"""
+    digest = hashlib.sha1()
+    for feature in sorted(features, key=lambda f: f['path']):
+        digest.update(f"{feature['path']}\0{feature['file_mtime']}\0{feature['file_size']}\n".encode())
+    return digest.hexdigest()
@@ -0,0 +1,235 @@
+import cv2
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # scipy is only needed for the k-d tree index
+    cKDTree = None
+
+METRICS = ('l1', 'l2', 'lab')
+
+# Upper bound for the temporary (chunk, tiles) distance arrays
+DEFAULT_CHUNK_BYTES = 64 * 1024 * 1024
+
+def bgr_to_lab(colors):
+    """Convert an (N, 3) array of BGR colors in 0-255 to CIE Lab"""
+    colors = np.asarray(colors, dtype=np.float32).reshape(-1, 1, 3) / 255.0
+    return cv2.cvtColor(colors, cv2.COLOR_BGR2Lab).reshape(-1, 3)
+
+def prepare_colors(colors, metric='l1'):
+    """Project colors into the space the metric measures distances in"""
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric '{metric}', expected one of {METRICS}")
+    if metric == 'lab':
+        return bgr_to_lab(colors).astype(np.float64)
+    return np.asarray(colors, dtype=np.float64).reshape(len(colors), -1)
+
+def region_descriptors(region_colors):
+    """Flatten (N, R, R, 3) BGR region means into an (N, R*R*3) float32 Lab matrix"""
+    region_colors = np.asarray(region_colors)
+    lab = bgr_to_lab(region_colors.reshape(-1, 3))
+    return lab.reshape(len(region_colors), -1).astype(np.float32)
+
+class PCA:
+    """Principal component projection fitted on the rows of data.
+
+    Used to shrink region descriptors to a few dimensions, which keeps the
+    k-d tree effective; cells must be projected with the PCA of the tiles.
+    """
+
+    def __init__(self, data, n_components):
+        data = np.asarray(data, dtype=np.float64)
+        self.mean = data.mean(axis=0)
+        n_components = max(1, min(n_components, data.shape[1], len(data)))
+        _, _, vt = np.linalg.svd(data - self.mean, full_matrices=False)
+        self.components = vt[:n_components]
+
+    def transform(self, data):
+        return ((np.asarray(data, dtype=np.float64) - self.mean) @ self.components.T).astype(np.float32)
+
+def _chunk_rows(n_tiles, n_arrays, itemsize, chunk_bytes):
+    return max(1, chunk_bytes // max(1, n_tiles * n_arrays * itemsize))
+
+def _pairwise_distances(queries, points, p, point_norms=None):
+    """Distances between every query row and every point row (L1 or L2)"""
+    if p == 1:
+        # Accumulate one dimension at a time to avoid an (N, M, D) temporary
+        dist = np.abs(queries[:, 0, None] - points[None, :, 0])
+        for d in range(1, queries.shape[1]):
+            dist += np.abs(queries[:, d, None] - points[None, :, d])
+        return dist
+
+    # |q - x|^2 = |q|^2 - 2 q.x + |x|^2
+    if point_norms is None:
+        point_norms = np.einsum('ij,ij->i', points, points)
+    query_norms = np.einsum('ij,ij->i', queries, queries)
+    sq = query_norms[:, None] - 2.0 * (queries @ points.T) + point_norms[None, :]
+    return np.sqrt(np.maximum(sq, 0.0))
+
+def _smallest_k(dist, k):
+    """Column indices of the k smallest entries per row, nearest first"""
+    if k == 1:
+        idx = np.argmin(dist, axis=1)[:, None]
+    else:
+        idx = np.argpartition(dist, k - 1, axis=1)[:, :k]
+        order = np.argsort(np.take_along_axis(dist, idx, axis=1), axis=1, kind='stable')
+        idx = np.take_along_axis(idx, order, axis=1)
+    return np.take_along_axis(dist, idx, axis=1), idx
+
+def brute_force_knn(queries, points, k=1, p=1, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """Exact k nearest points for every query, computed in bounded chunks"""
+    k = min(k, len(points))
+    distances = np.empty((len(queries), k), dtype=np.float64)
+    indices = np.empty((len(queries), k), dtype=np.int64)
+    point_norms = np.einsum('ij,ij->i', points, points) if p == 2 else None
+
+    # Both metrics materialise two (chunk, M) float64 arrays at a time
+    step = _chunk_rows(len(points), 2, points.itemsize, chunk_bytes)
+    for start in range(0, len(queries), step):
+        dist = _pairwise_distances(queries[start:start + step], points, p, point_norms)
+        distances[start:start + step], indices[start:start + step] = _smallest_k(dist, k)
+
+    return distances, indices
+
+class TileIndex:
+    """Nearest-neighbour index over tile feature vectors.
+
+    Subclasses implement _query on features already projected by
+    prepare_colors. query() returns (distances, indices), both (N, k) and
+    sorted nearest first, so callers can choose among several candidates.
+    """
+    exact = True
+
+    def __init__(self, tile_colors, metric='l1'):
+        if len(tile_colors) == 0:
+            raise ValueError("No tile colors to index")
+        self.metric = metric
+        self.p = 1 if metric == 'l1' else 2
+        self.points = prepare_colors(tile_colors, metric)
+
+    def __len__(self):
+        return len(self.points)
+
+    def query(self, colors, k=1):
+        queries = prepare_colors(colors, self.metric)
+        return self._query(queries, min(k, len(self.points)))
+
+    def _query(self, queries, k):
+        raise NotImplementedError
+
+class BruteForceIndex(TileIndex):
+    """Exact search by chunked brute force; best for small libraries"""
+
+    def __init__(self, tile_colors, metric='l1', chunk_bytes=DEFAULT_CHUNK_BYTES):
+        super().__init__(tile_colors, metric)
+        self.chunk_bytes = chunk_bytes
+
+    def _query(self, queries, k):
+        return brute_force_knn(queries, self.points, k, self.p, self.chunk_bytes)
+
+class KDTreeIndex(TileIndex):
+    """k-d tree search (scipy); eps > 0 turns it into approximate search.
+
+    With eps > 0 every returned neighbour is within (1 + eps) times the
+    distance of the true k-th nearest tile.
+    """
+
+    def __init__(self, tile_colors, metric='l1', eps=0.0, leafsize=16):
+        if cKDTree is None:
+            raise ImportError("The k-d tree index requires scipy (pip install scipy)")
+        super().__init__(tile_colors, metric)
+        self.eps = eps
+        self.exact = eps == 0
+        self.tree = cKDTree(self.points, leafsize=leafsize)
+
+    def _query(self, queries, k):
+        distances, indices = self.tree.query(queries, k=k, p=self.p, eps=self.eps)
+        if k == 1:
+            distances, indices = distances[:, None], indices[:, None]
+        return distances, indices.astype(np.int64)
+
+class IVFIndex(TileIndex):
+    """Approximate search over k-means buckets (inverted file), NumPy only.
+
+    Tiles are grouped around n_lists centroids; a query only scans the
+    tiles in its n_probe nearest buckets. More probes trade speed for recall.
+    When those buckets hold fewer than k tiles the rest of the row is
+    padded with index -1 at distance inf.
+    """
+    exact = False
+
+    def __init__(self, tile_colors, metric='l1', n_lists=None, n_probe=4, iterations=10, seed=0):
+        super().__init__(tile_colors, metric)
+        if n_lists is None:
+            n_lists = int(np.sqrt(len(self.points)))
+        self.n_lists = max(1, min(n_lists, len(self.points)))
+        self.n_probe = max(1, min(n_probe, self.n_lists))
+        self.centroids = self._train(iterations, np.random.default_rng(seed))
+
+        assignments = brute_force_knn(self.points, self.centroids, 1, self.p)[1][:, 0]
+        order = np.argsort(assignments, kind='stable')
+        self.list_members = np.split(order, np.cumsum(np.bincount(assignments, minlength=self.n_lists))[:-1])
+
+    def _train(self, iterations, rng):
+        sample = self.points
+        if len(sample) > 256 * self.n_lists:
+            sample = sample[rng.choice(len(sample), 256 * self.n_lists, replace=False)]
+        centroids = sample[rng.choice(len(sample), self.n_lists, replace=False)].copy()
+
+        for _ in range(iterations):
+            labels = brute_force_knn(sample, centroids, 1, self.p)[1][:, 0]
+            counts = np.bincount(labels, minlength=self.n_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+        return centroids
+
+    def _query(self, queries, k):
+        best_dist = np.full((len(queries), k), np.inf)
+        best_idx = np.full((len(queries), k), -1, dtype=np.int64)
+        probes = brute_force_knn(queries, self.centroids, self.n_probe, self.p)[1]
+
+        # Visit each (probe rank, bucket) pair once with all of its queries
+        for rank in range(probes.shape[1]):
+            for bucket in np.unique(probes[:, rank]):
+                members = self.list_members[bucket]
+                if len(members) == 0:
+                    continue
+                rows = np.nonzero(probes[:, rank] == bucket)[0]
+                dist = _pairwise_distances(queries[rows], self.points[members], self.p)
+                merged_dist = np.concatenate([best_dist[rows], dist], axis=1)
+                merged_idx = np.concatenate([best_idx[rows], np.broadcast_to(members, dist.shape)], axis=1)
+                top_dist, top = _smallest_k(merged_dist, k)
+                best_dist[rows] = top_dist
+                best_idx[rows] = np.take_along_axis(merged_idx, top, axis=1)
+
+        return best_dist, best_idx
+
+INDEX_TYPES = {
+    'brute': BruteForceIndex,
+    'kdtree': KDTreeIndex,
+    'ivf': IVFIndex,
+}
+
+def build_tile_index(tile_colors, kind='auto', metric='l1', approximate=False, **options):
+    """Build a nearest-neighbour index over tile colors.
+
+    kind is one of INDEX_TYPES or 'auto', which uses brute force for small
+    libraries and a k-d tree for large ones (IVF when scipy is missing and
+    approximate results are acceptable). With approximate=True the k-d tree
+    gets a default eps of 0.5.
+    """
+    if kind == 'auto':
+        if len(tile_colors) <= 2048:
+            kind = 'brute'
+        elif cKDTree is not None:
+            kind = 'kdtree'
+        else:
+            kind = 'ivf' if approximate else 'brute'
+
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{kind}', expected one of {tuple(INDEX_TYPES)}")
+    if approximate and kind == 'kdtree':
+        options.setdefault('eps', 0.5)
+    return INDEX_TYPES[kind](tile_colors, metric, **options)